@@ -0,0 +1,5 @@
+"""
+Benchmark suite for serialization and `Repository` hot paths.
+
+Run with `python -m benchmarks run` and compare two result files with `python -m benchmarks compare`.
+"""
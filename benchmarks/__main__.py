@@ -0,0 +1,46 @@
+import argparse
+import sys
+
+from .data import SCALES
+from .runner import compare_results, format_comparison, load_results, run_benchmarks, save_results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='run the benchmark scenarios')
+    run.add_argument('--seed', type=int, default=42)
+    run.add_argument('--scale', choices=list(SCALES), default='small')
+    run.add_argument('--repeat', type=int, default=5)
+    run.add_argument('--filter', dest='pattern', help='regular expression matching scenario names')
+    run.add_argument('--output', help='write results as JSON to this file')
+    run.add_argument('--mongo-uri', help='run repository scenarios against this MongoDB, '
+                                         'ex: mongodb://localhost/bpr_benchmark. The database is cleared')
+
+    compare = commands.add_parser('compare', help='compare two result files')
+    compare.add_argument('baseline')
+    compare.add_argument('current')
+    compare.add_argument('--threshold', type=float, default=0.1,
+                         help='relative slowdown flagged as a regression (default: 0.1)')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        results = run_benchmarks(args.seed, args.scale, args.repeat, args.pattern, args.mongo_uri)
+        if args.output:
+            save_results(results, args.output)
+        return 0
+
+    baseline, current = load_results(args.baseline), load_results(args.current)
+    if baseline['meta']['seed'] != current['meta']['seed'] or baseline['meta']['scale'] != current['meta']['scale']:
+        print('warning: results were generated with different seeds or scales', file=sys.stderr)
+    if baseline['meta'].get('backend', 'memory') != current['meta'].get('backend', 'memory'):
+        print('warning: results were generated on different backends', file=sys.stderr)
+    rows = compare_results(baseline, current, args.threshold)
+    print(format_comparison(rows))
+    return 1 if any(x['status'] == 'regression' for x in rows) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
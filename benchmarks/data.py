@@ -0,0 +1,226 @@
+"""
+Seeded synthetic data generator.
+
+The same seed and scale always produce the same documents, ids included, so results of separate runs are comparable.
+"""
+from __future__ import annotations
+
+import random
+from dataclasses import dataclass
+
+from bson.objectid import ObjectId
+
+from bpr_data.memory_backend import MemoryClient
+from bpr_data.repository import Collection, Repository
+
+
+@dataclass
+class Scale:
+    workspaces: int
+    users: int
+    teams_per_workspace: int
+    projects_per_workspace: int
+    models_per_project: int
+    diagrams_per_project: int
+    representations_per_diagram: int
+    max_attributes: int
+    max_relations: int
+    max_updates: int
+
+
+SCALES = {
+    'small': Scale(workspaces=2, users=20, teams_per_workspace=2, projects_per_workspace=2,
+                   models_per_project=40, diagrams_per_project=4, representations_per_diagram=15,
+                   max_attributes=8, max_relations=3, max_updates=4),
+    'medium': Scale(workspaces=5, users=200, teams_per_workspace=4, projects_per_workspace=4,
+                    models_per_project=200, diagrams_per_project=10, representations_per_diagram=40,
+                    max_attributes=12, max_relations=4, max_updates=10),
+    'large': Scale(workspaces=10, users=1000, teams_per_workspace=8, projects_per_workspace=6,
+                   models_per_project=1000, diagrams_per_project=25, representations_per_diagram=80,
+                   max_attributes=16, max_relations=6, max_updates=25),
+}
+
+MODEL_TYPES = ['class', 'interface', 'abstractClass', 'enum']
+RELATION_TYPES = ['association', 'aggregation', 'composition', 'inheritance', 'realization', 'dependency']
+ACCESS_MODIFIERS = ['public', 'private', 'protected', 'package']
+DATA_TYPES = ['int', 'string', 'bool', 'float', 'List<string>', 'Map<string, int>', 'void']
+CARDINALITIES = ['1', '0..1', '0..*', '1..*']
+WORDS = ['order', 'customer', 'invoice', 'product', 'account', 'payment', 'shipment', 'address', 'item', 'report',
+         'session', 'token', 'event', 'message', 'queue', 'handler', 'service', 'factory', 'builder', 'entity']
+FOLDERS = ['/domain', '/domain/entities', '/domain/values', '/services', '/services/internal', '/infrastructure',
+           '/api', '/api/dto']
+
+
+class DataGenerator:
+    """
+    Generates documents shaped like the output of `as_dict` on the models in `bpr_data.models`.
+    """
+
+    def __init__(self, seed: int = 42, scale: str = 'small'):
+        self.seed = seed
+        self.scale_name = scale
+        self.scale = SCALES[scale]
+        self._rng = random.Random(seed)
+        self._clock = 0
+
+    def object_id(self) -> ObjectId:
+        return ObjectId(self._rng.getrandbits(96).to_bytes(12, 'big'))
+
+    def timestamp(self) -> str:
+        self._clock += self._rng.randint(1, 600)
+        hours, rest = divmod(self._clock, 3600)
+        minutes, seconds = divmod(rest, 60)
+        day = 1 + (hours // 24) % 28
+        return f'2021-11-{day:02d}T{hours % 24:02d}:{minutes:02d}:{seconds:02d}'
+
+    def name(self, words: int = 2) -> str:
+        return ''.join(self._rng.choice(WORDS).capitalize() for _ in range(words))
+
+    def generate(self) -> dict:
+        """
+        :return: dict of Collection to list of documents
+        """
+        scale = self.scale
+        data = {c: [] for c in Collection}
+
+        users = [self.user() for _ in range(scale.users)]
+        data[Collection.USER] = users
+
+        for _ in range(scale.workspaces):
+            members = self._rng.sample(users, min(len(users), max(2, scale.users // 2)))
+            workspace = self.workspace(members)
+            data[Collection.WORKSPACE].append(workspace)
+
+            teams = [self.team(workspace, members) for _ in range(scale.teams_per_workspace)]
+            data[Collection.TEAM].extend(teams)
+            data[Collection.INVITATION].extend(self.invitation(workspace, members)
+                                               for _ in range(max(1, scale.users // 10)))
+
+            for _ in range(scale.projects_per_workspace):
+                project = self.project(workspace, members, teams)
+                data[Collection.PROJECT].append(project)
+
+                models = [self.model(project, members) for _ in range(scale.models_per_project)]
+                for model in models:
+                    self.add_relations(model, models, members)
+                data[Collection.MODEL].extend(models)
+
+                for _ in range(scale.diagrams_per_project):
+                    diagram = self.diagram(project)
+                    count = min(len(models), scale.representations_per_diagram)
+                    representations = [self.representation(diagram, m) for m in self._rng.sample(models, count)]
+                    diagram['models'] = [r['_id'] for r in representations]
+                    data[Collection.DIAGRAM].append(diagram)
+                    data[Collection.MODEL_REPRESENTATION].extend(representations)
+        return data
+
+    def user(self) -> dict:
+        name = self.name(1)
+        return {'_id': self.object_id(), 'name': name, 'email': f'{name.lower()}{self._rng.randint(0, 9999)}@mail.com',
+                'firebaseId': f'{self._rng.getrandbits(128):032x}'}
+
+    def workspace(self, members: list) -> dict:
+        return {'_id': self.object_id(), 'name': self.name(),
+                'users': [{'userId': u['_id'], 'permissions': self._rng.sample(
+                    ['MANAGE_TEAMS', 'MANAGE_PERMISSIONS', 'MANAGE_WORKSPACE'], self._rng.randint(0, 3))}
+                          for u in members]}
+
+    def team(self, workspace: dict, members: list) -> dict:
+        team_members = self._rng.sample(members, self._rng.randint(1, len(members)))
+        return {'_id': self.object_id(), 'name': self.name(), 'workspaceId': workspace['_id'],
+                'users': [{'userId': u['_id']} for u in team_members]}
+
+    def invitation(self, workspace: dict, members: list) -> dict:
+        return {'_id': self.object_id(), 'inviterId': self._rng.choice(members)['_id'],
+                'workspaceId': workspace['_id'], 'inviteeEmailAddress': f'{self.name(1).lower()}@mail.com'}
+
+    def project(self, workspace: dict, members: list, teams: list) -> dict:
+        project_users = self._rng.sample(members, self._rng.randint(1, len(members)))
+        project_teams = self._rng.sample(teams, self._rng.randint(0, len(teams)))
+        return {'_id': self.object_id(), 'title': self.name(), 'workspaceId': workspace['_id'],
+                'users': [{'userId': u['_id'], 'isEditor': self._rng.random() < 0.7,
+                           'isProjectManager': self._rng.random() < 0.1} for u in project_users],
+                'teams': [{'teamId': t['_id'], 'isEditor': self._rng.random() < 0.5} for t in project_teams],
+                'folders': list(FOLDERS)}
+
+    def diagram(self, project: dict) -> dict:
+        return {'_id': self.object_id(), 'title': self.name(), 'projectId': project['_id'],
+                'path': self._rng.choice(['/'] + FOLDERS), 'models': []}
+
+    def attribute(self) -> dict:
+        roll = self._rng.random()
+        if roll < 0.6:
+            return {'_id': self.object_id(), 'name': self.name(1).lower(), 'type': self._rng.choice(DATA_TYPES),
+                    'accessModifier': self._rng.choice(ACCESS_MODIFIERS), 'kind': 'field'}
+        if roll < 0.95:
+            return {'_id': self.object_id(), 'name': self.name(2), 'type': self._rng.choice(DATA_TYPES),
+                    'accessModifier': self._rng.choice(ACCESS_MODIFIERS), 'kind': 'method',
+                    'parameters': [{'name': self.name(1).lower(), 'type': self._rng.choice(DATA_TYPES)}
+                                   for _ in range(self._rng.randint(0, 4))]}
+        return {'_id': self.object_id(), 'value': self.name(1), 'kind': 'stereotype'}
+
+    def relation(self, target: dict) -> dict:
+        return {'_id': self.object_id(), 'target': target['_id'], 'type': self._rng.choice(RELATION_TYPES),
+                'accessModifier': self._rng.choice(ACCESS_MODIFIERS),
+                'parentCardinality': self._rng.choice(CARDINALITIES),
+                'childCardinality': self._rng.choice(CARDINALITIES),
+                'parentName': self.name(1).lower(), 'childName': self.name(1).lower(), 'name': self.name(1).lower()}
+
+    def model(self, project: dict, members: list) -> dict:
+        model = {'_id': self.object_id(), 'type': self._rng.choice(MODEL_TYPES), 'projectId': project['_id'],
+                 'path': self._rng.choice(['/'] + FOLDERS), 'history': [], 'relations': [], 'attributes': []}
+        model['history'].append({'timestamp': self.timestamp(), 'userId': self._rng.choice(members)['_id'],
+                                 'action': 'createModel'})
+        for _ in range(self._rng.randint(0, self.scale.max_attributes)):
+            attribute = self.attribute()
+            model['attributes'].append(attribute)
+            model['history'].append({'timestamp': self.timestamp(), 'userId': self._rng.choice(members)['_id'],
+                                     'item': attribute, 'action': 'addAttribute'})
+        for _ in range(self._rng.randint(0, self.scale.max_updates)):
+            if not model['attributes']:
+                break
+            index = self._rng.randrange(len(model['attributes']))
+            old_item = model['attributes'][index]
+            new_item = dict(old_item, name=self.name(1).lower()) if 'name' in old_item else dict(old_item)
+            model['attributes'][index] = new_item
+            model['history'].append({'timestamp': self.timestamp(), 'userId': self._rng.choice(members)['_id'],
+                                     'oldItem': old_item, 'newItem': new_item, 'action': 'updateAttribute'})
+        return model
+
+    def add_relations(self, model: dict, models: list, members: list):
+        for _ in range(self._rng.randint(0, self.scale.max_relations)):
+            target = self._rng.choice(models)
+            if target is model:
+                continue
+            relation = self.relation(target)
+            model['relations'].append(relation)
+            model['history'].append({'timestamp': self.timestamp(), 'userId': self._rng.choice(members)['_id'],
+                                     'item': relation, 'action': 'createRelation'})
+
+    def representation(self, diagram: dict, model: dict) -> dict:
+        return {'_id': self.object_id(), 'modelId': model['_id'], 'diagramId': diagram['_id'],
+                'relations': [{'_id': self.object_id(), 'relationId': r['_id']} for r in model['relations']],
+                'x': float(self._rng.randint(0, 4000)), 'y': float(self._rng.randint(0, 3000)),
+                'w': float(self._rng.randint(80, 320)), 'h': float(self._rng.randint(40, 240))}
+
+
+def load_repository(data: dict, client=None) -> Repository:
+    """
+    Creates a `Repository` holding only the given documents.
+    :param data: dict of Collection to list of documents, as returned by `DataGenerator.generate`
+    :param client: Optional! `MongoClient` to load the documents into. Its default database is cleared first.
+        Uses a fresh in-memory client if omitted
+    :return: the repository
+    """
+    if client is None:
+        client = MemoryClient('benchmark')
+    database = client.get_default_database()
+    for collection in Collection:
+        database.drop_collection(collection.value)
+    for collection, documents in data.items():
+        if documents:
+            database[collection.value].insert_many(documents)
+    Repository.reset_instance()
+    repository = Repository.get_instance('', '', '', '', 'benchmark', client)
+    repository.create_indexes()
+    return repository
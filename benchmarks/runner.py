@@ -0,0 +1,130 @@
+"""
+Runs scenarios, writes results as JSON and compares two result files.
+"""
+from __future__ import annotations
+
+import json
+import platform
+import re
+import statistics
+import sys
+import timeit
+from datetime import datetime, timezone
+
+import pymongo
+
+from .data import DataGenerator, load_repository
+from .scenarios import SCENARIOS
+
+FORMAT_VERSION = 1
+
+
+def run_benchmarks(seed: int = 42, scale: str = 'small', repeat: int = 5, pattern: str = None,
+                   mongo_uri: str = None, log=print) -> dict:
+    """
+    Runs all scenarios matching `pattern`.
+    Every scenario is timed `repeat` times with an automatically calibrated number of iterations.
+    :param seed: seed for the data generator
+    :param scale: name of a scale in `data.SCALES`
+    :param repeat: number of timed rounds per scenario
+    :param pattern: Optional! regular expression that scenario names must match
+    :param mongo_uri: Optional! runs repository scenarios against this MongoDB instead of the in-memory engine.
+        The URI must name a database, which is cleared before each scenario
+    :param log: function receiving progress lines
+    :return: results in the format written by `save_results`
+    """
+    data = DataGenerator(seed, scale).generate()
+    client = pymongo.MongoClient(mongo_uri) if mongo_uri else None
+    results = {}
+    try:
+        _run_scenarios(data, client, repeat, pattern, log, results)
+    finally:
+        if client is not None:
+            client.close()
+    return {
+        'format': FORMAT_VERSION,
+        'meta': {
+            'seed': seed,
+            'scale': scale,
+            'repeat': repeat,
+            'backend': 'mongodb' if mongo_uri else 'memory',
+            'python': sys.version.split()[0],
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+        },
+        'results': results,
+    }
+
+
+def _run_scenarios(data: dict, client, repeat: int, pattern: str, log, results: dict):
+    for name, (func, uses_repository) in SCENARIOS.items():
+        if pattern and not re.search(pattern, name):
+            continue
+        repository = load_repository(data, client) if uses_repository else None
+        timer = timeit.Timer(func(data, repository))
+        number, _ = timer.autorange()
+        timings = [x / number for x in timer.repeat(repeat, number)]
+        results[name] = {
+            'unit': 'seconds',
+            'iterations': number,
+            'rounds': repeat,
+            'min': min(timings),
+            'median': statistics.median(timings),
+            'mean': statistics.mean(timings),
+            'stdev': statistics.stdev(timings) if len(timings) > 1 else 0.0,
+            'ops_per_second': 1 / statistics.median(timings),
+        }
+        log(f'{name:<45} {results[name]["median"] * 1e6:>12.1f} us')
+
+
+def save_results(results: dict, path: str):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+def load_results(path: str) -> dict:
+    with open(path) as f:
+        results = json.load(f)
+    if results.get('format') != FORMAT_VERSION:
+        raise ValueError(f'{path} is not a benchmark result file of format {FORMAT_VERSION}')
+    return results
+
+
+def compare_results(baseline: dict, current: dict, threshold: float = 0.1) -> list:
+    """
+    Compares the median timings of two runs.
+    :param baseline: results of the reference run
+    :param current: results of the run to check
+    :param threshold: relative slowdown above which a scenario is flagged as a regression
+    :return: list of dicts with `name`, `baseline`, `current`, `change` and `status` for each scenario
+    """
+    rows = []
+    names = list(baseline['results']) + [x for x in current['results'] if x not in baseline['results']]
+    for name in names:
+        old = baseline['results'].get(name)
+        new = current['results'].get(name)
+        if old is None or new is None:
+            rows.append({'name': name, 'baseline': old and old['median'], 'current': new and new['median'],
+                         'change': None, 'status': 'added' if old is None else 'removed'})
+            continue
+        change = new['median'] / old['median'] - 1
+        if change > threshold:
+            status = 'regression'
+        elif change < -threshold:
+            status = 'improvement'
+        else:
+            status = 'unchanged'
+        rows.append({'name': name, 'baseline': old['median'], 'current': new['median'], 'change': change,
+                     'status': status})
+    return rows
+
+
+def format_comparison(rows: list) -> str:
+    lines = [f'{"scenario":<45} {"baseline us":>12} {"current us":>12} {"change":>8}  status']
+    for row in rows:
+        baseline = f'{row["baseline"] * 1e6:.1f}' if row['baseline'] is not None else '-'
+        current = f'{row["current"] * 1e6:.1f}' if row['current'] is not None else '-'
+        change = f'{row["change"]:+.1%}' if row['change'] is not None else '-'
+        lines.append(f'{row["name"]:<45} {baseline:>12} {current:>12} {change:>8}  {row["status"]}')
+    return '\n'.join(lines)
@@ -0,0 +1,270 @@
+"""
+Benchmark scenarios.
+
+Each scenario receives the generated data and, for repository scenarios, a freshly loaded `Repository`,
+and returns the zero-argument callable that is timed.
+Scenarios that write to the repository undo or toggle their changes, so repeated runs measure the same state.
+"""
+from __future__ import annotations
+
+import io
+import json
+import random
+
+from bpr_data.models.model import AttributeBase, FullModelRepresentation, Model, ModelRepresentation
+from bpr_data.cascade import cascade_delete
+from bpr_data.folders import list_folder, move_folder
+from bpr_data.join_builder import JoinBuilder, find_invitations
+from bpr_data.models.project import Project
+from bpr_data.project_archive import duplicate_project, export_project
+from bpr_data.relation_graph import RelationGraph, find_related_models
+from bpr_data.repository import Collection
+from bpr_data.spatial_index import SpatialIndex, find_in_viewport
+
+SCENARIOS = {}
+
+
+def scenario(name: str, uses_repository: bool = False):
+    def decorator(func):
+        SCENARIOS[name] = (func, uses_repository)
+        return func
+
+    return decorator
+
+
+def _largest_project(data: dict) -> dict:
+    counts = {}
+    for model in data[Collection.MODEL]:
+        counts[model['projectId']] = counts.get(model['projectId'], 0) + 1
+    project_id = max(counts, key=counts.get)
+    return next(x for x in data[Collection.PROJECT] if x['_id'] == project_id)
+
+
+def _sample(data: dict, collection: Collection, count: int = 50) -> list:
+    documents = data[collection]
+    return random.Random(0).sample(documents, min(count, len(documents)))
+
+
+# SERIALIZATION
+
+@scenario('serialization.model_from_dict')
+def model_from_dict(data, repository):
+    models = _sample(data, Collection.MODEL)
+    return lambda: Model.from_dict_list(models)
+
+
+@scenario('serialization.model_as_dict')
+def model_as_dict(data, repository):
+    models = Model.from_dict_list(_sample(data, Collection.MODEL))
+    return lambda: Model.as_dict_list(models)
+
+
+@scenario('serialization.model_as_json')
+def model_as_json(data, repository):
+    models = Model.from_dict_list(_sample(data, Collection.MODEL))
+    return lambda: Model.as_json_list(models)
+
+
+@scenario('serialization.project_from_json')
+def project_from_json(data, repository):
+    projects = json.dumps(data[Collection.PROJECT], default=str)
+    return lambda: Project.from_json_list(projects)
+
+
+@scenario('serialization.attribute_parse')
+def attribute_parse(data, repository):
+    attributes = [a for m in _sample(data, Collection.MODEL, 200) for a in m['attributes']]
+    return lambda: [AttributeBase.parse(a) for a in attributes]
+
+
+@scenario('serialization.attribute_parse_json')
+def attribute_parse_json(data, repository):
+    attributes = [json.dumps(a, default=str) for m in _sample(data, Collection.MODEL, 200) for a in m['attributes']]
+    return lambda: [AttributeBase.parse(a) for a in attributes]
+
+
+# REST SERVER WORKLOADS
+
+@scenario('repository.find_project_models', uses_repository=True)
+def find_project_models(data, repository):
+    project = _largest_project(data)
+    return lambda: repository.find(Collection.MODEL, projectId=project['_id'], return_type=Model)
+
+
+@scenario('repository.find_one_by_id', uses_repository=True)
+def find_one_by_id(data, repository):
+    ids = [str(x['_id']) for x in _sample(data, Collection.MODEL)]
+    return lambda: [repository.find_one(Collection.MODEL, id=x) for x in ids]
+
+
+@scenario('repository.find_user_workspaces', uses_repository=True)
+def find_user_workspaces(data, repository):
+    user_id = data[Collection.USER][0]['_id']
+    return lambda: repository.find(Collection.WORKSPACE, nested_conditions={'users.userId': user_id})
+
+
+@scenario('repository.join_project_users', uses_repository=True)
+def join_project_users(data, repository):
+    project = _largest_project(data)
+    return lambda: repository.join(Collection.PROJECT, 'users.userId', Collection.USER, '_id', 'userObjects',
+                                   id=str(project['_id']))
+
+
+@scenario('repository.join_diagram_representations', uses_repository=True)
+def join_diagram_representations(data, repository):
+    diagram = data[Collection.DIAGRAM][0]
+    return lambda: repository.join(Collection.MODEL_REPRESENTATION, 'modelId', Collection.MODEL, '_id', 'model',
+                                   unwind=True, return_type=FullModelRepresentation, diagramId=diagram['_id'])
+
+
+@scenario('repository.insert_delete_model', uses_repository=True)
+def insert_delete_model(data, repository):
+    model = Model.from_dict(data[Collection.MODEL][0])
+
+    def run():
+        inserted = repository.insert(Collection.MODEL, model, return_type=Model)
+        repository.delete(Collection.MODEL, _id=inserted.id)
+
+    return run
+
+
+# SOCKET SERVER WORKLOADS
+
+@scenario('repository.update_representation', uses_repository=True)
+def update_representation(data, repository):
+    representation = ModelRepresentation.from_dict(data[Collection.MODEL_REPRESENTATION][0])
+    step = [1]
+
+    def run():
+        # Moves back and forth, so the representation never drifts from its original position
+        representation.x += step[0]
+        step[0] = -step[0]
+        repository.update(Collection.MODEL_REPRESENTATION, representation)
+
+    return run
+
+
+@scenario('repository.push_pull_attribute', uses_repository=True)
+def push_pull_attribute(data, repository):
+    model = _sample(data, Collection.MODEL, 1)[0]
+    attribute = {'_id': None, 'name': 'benchmark', 'type': 'int', 'accessModifier': 'public', 'kind': 'field'}
+
+    def run():
+        repository.push(Collection.MODEL, model['_id'], 'attributes', attribute)
+        repository.pull(Collection.MODEL, model['_id'], 'attributes', {'name': 'benchmark'})
+
+    return run
+
+
+@scenario('repository.update_list_item', uses_repository=True)
+def update_list_item(data, repository):
+    model = next(x for x in data[Collection.MODEL] if x['attributes'])
+    attribute = dict(model['attributes'][0])
+
+    def run():
+        attribute['accessModifier'] = 'private' if attribute['accessModifier'] == 'public' else 'public'
+        repository.update_list_item(Collection.MODEL, model['_id'], 'attributes',
+                                     {'attributes._id': attribute['_id']}, attribute)
+
+    return run
+
+
+# RELATION GRAPH
+
+@scenario('relation_graph.build', uses_repository=True)
+def relation_graph_build(data, repository):
+    project = _largest_project(data)
+    return lambda: RelationGraph.build(repository, project['_id'])
+
+
+@scenario('relation_graph.dependents', uses_repository=True)
+def relation_graph_dependents(data, repository):
+    project = _largest_project(data)
+    graph = RelationGraph.build(repository, project['_id'])
+    models = [x['_id'] for x in data[Collection.MODEL] if x['projectId'] == project['_id']][:20]
+    return lambda: [graph.dependents(x) for x in models]
+
+
+@scenario('relation_graph.find_related_models', uses_repository=True)
+def relation_graph_find_related_models(data, repository):
+    project = _largest_project(data)
+    models = [x['_id'] for x in data[Collection.MODEL] if x['projectId'] == project['_id']][:20]
+    return lambda: [find_related_models(repository, x, max_depth=3) for x in models]
+
+
+# SPATIAL INDEX
+
+@scenario('spatial_index.build', uses_repository=True)
+def spatial_index_build(data, repository):
+    diagram = data[Collection.DIAGRAM][0]
+    return lambda: SpatialIndex.build(repository, diagram['_id'])
+
+
+@scenario('spatial_index.query_many', uses_repository=True)
+def spatial_index_query_many(data, repository):
+    index = SpatialIndex.build(repository, data[Collection.DIAGRAM][0]['_id'])
+    rng = random.Random(0)
+    viewports = [(rng.uniform(0, 4000), rng.uniform(0, 3000), 1280, 720) for _ in range(100)]
+    return lambda: index.query_many(viewports)
+
+
+@scenario('spatial_index.find_in_viewport', uses_repository=True)
+def spatial_index_find_in_viewport(data, repository):
+    diagram = data[Collection.DIAGRAM][0]
+    return lambda: find_in_viewport(repository, diagram['_id'], 1000, 1000, 1280, 720)
+
+
+# FOLDERS
+
+@scenario('folders.list_folder', uses_repository=True)
+def folders_list_folder(data, repository):
+    project = _largest_project(data)
+    return lambda: list_folder(repository, project['_id'], '/domain')
+
+
+@scenario('folders.move_folder', uses_repository=True)
+def folders_move_folder(data, repository):
+    project = _largest_project(data)
+
+    def run():
+        move_folder(repository, project['_id'], '/domain', '/moved')
+        move_folder(repository, project['_id'], '/moved', '/domain')
+
+    return run
+
+
+# JOIN BUILDER
+
+@scenario('join_builder.find_invitations', uses_repository=True)
+def join_builder_find_invitations(data, repository):
+    workspace = data[Collection.WORKSPACE][0]
+    return lambda: find_invitations(repository, workspaceId=workspace['_id'])
+
+
+@scenario('join_builder.project_users_and_teams', uses_repository=True)
+def join_builder_project_users_and_teams(data, repository):
+    project = _largest_project(data)
+    builder = JoinBuilder(Collection.PROJECT) \
+        .match(_id=project['_id']) \
+        .lookup(Collection.USER, 'users.userId', '_id', 'userObjects', ['name', 'email']) \
+        .lookup(Collection.TEAM, 'teams.teamId', '_id', 'teamObjects', ['name'])
+    return lambda: builder.execute(repository)
+
+
+# PROJECT ARCHIVE
+
+@scenario('project_archive.duplicate_project', uses_repository=True)
+def project_archive_duplicate_project(data, repository):
+    project = _largest_project(data)
+
+    def run():
+        copy_id = duplicate_project(repository, project['_id'])
+        cascade_delete(repository, Collection.PROJECT, [copy_id])
+
+    return run
+
+
+@scenario('project_archive.export_project', uses_repository=True)
+def project_archive_export_project(data, repository):
+    project = _largest_project(data)
+    return lambda: export_project(repository, project['_id'], io.BytesIO())
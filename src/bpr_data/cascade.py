@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+from bson.objectid import ObjectId
+
+from .repository import Collection, Repository
+
+# Parent collection -> list of (child collection, field on the child referencing the parent's _id)
+CHILDREN = {
+    Collection.WORKSPACE: [
+        (Collection.PROJECT, 'workspaceId'),
+        (Collection.TEAM, 'workspaceId'),
+        (Collection.INVITATION, 'workspaceId'),
+    ],
+    Collection.PROJECT: [
+        (Collection.DIAGRAM, 'projectId'),
+        (Collection.MODEL, 'projectId'),
+    ],
+    Collection.DIAGRAM: [
+        (Collection.MODEL_REPRESENTATION, 'diagramId'),
+    ],
+    Collection.MODEL: [
+        (Collection.MODEL_REPRESENTATION, 'modelId'),
+    ],
+}
+
+# Deleted collection -> list of (collection, list field, key in list items or None for plain id lists)
+# References in these lists are pulled, as they would otherwise point to deleted documents
+REFERENCES = {
+    Collection.USER: [
+        (Collection.WORKSPACE, 'users', 'userId'),
+        (Collection.TEAM, 'users', 'userId'),
+        (Collection.PROJECT, 'users', 'userId'),
+    ],
+    Collection.TEAM: [
+        (Collection.PROJECT, 'teams', 'teamId'),
+    ],
+    Collection.MODEL: [
+        (Collection.MODEL, 'relations', 'target'),
+    ],
+    Collection.MODEL_REPRESENTATION: [
+        (Collection.DIAGRAM, 'models', None),
+    ],
+}
+
+
+def cascade_delete(repository: Repository,
+                   collection: Collection,
+                   ids: list,
+                   use_transaction: bool = False,
+                   batch_size: int = 1000) -> dict:
+    """
+    Deletes documents and everything below them in the `CHILDREN` hierarchy.
+
+    The hierarchy is walked level by level. On each level the ids of the children are collected and the documents
+    are deleted with one `delete_many` per batch of ids, after which references to them (see `REFERENCES`)
+    are pulled with one `update_many` per batch.
+
+    :param repository: repository to delete from
+    :param collection: collection of the documents to delete
+    :param ids: ids of the documents to delete
+    :param use_transaction: if True, runs all operations in a transaction, so nothing is deleted if one fails.
+        Requires a replica set when used with MongoDB
+    :param batch_size: maximum number of ids in each `$in` query
+    :return: number of deleted documents per collection
+    """
+    ids = [ObjectId(x) if isinstance(x, str) else x for x in ids]
+    if use_transaction:
+        with repository.transaction() as session:
+            return _cascade(repository, collection, ids, batch_size, session)
+    return _cascade(repository, collection, ids, batch_size, None)
+
+
+def _cascade(repository: Repository, collection: Collection, ids: list, batch_size: int, session) -> dict:
+    counts = {}
+    level = {collection: ids}
+    while level:
+        next_level = {}
+        for current, current_ids in level.items():
+            for batch in _batches(current_ids, batch_size):
+                for child, field in CHILDREN.get(current, []):
+                    child_ids = repository.distinct(child, '_id', {field: {'$in': batch}}, session)
+                    next_level.setdefault(child, []).extend(child_ids)
+
+                deleted = repository.delete_many(current, {'_id': {'$in': batch}}, session)
+                counts[current] = counts.get(current, 0) + deleted
+
+                for referencing, field, key in REFERENCES.get(current, []):
+                    path = f'{field}.{key}' if key else field
+                    condition = {key: {'$in': batch}} if key else {'$in': batch}
+                    repository.update_many(referencing, {path: {'$in': batch}}, {'$pull': {field: condition}},
+                                           session)
+        level = {c: list(dict.fromkeys(x)) for c, x in next_level.items() if x}
+    return counts
+
+
+def _batches(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
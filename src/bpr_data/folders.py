@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+
+from bson.objectid import ObjectId
+
+from .models.diagram import Diagram
+from .models.model import Model
+from .models.mongo_document_base import SerializableObject
+from .repository import Collection, Repository
+
+ROOT = '/'
+
+
+@dataclass
+class FolderListing(SerializableObject):
+    path: str
+    folders: list  # str, direct subfolders
+    models: list  # Model
+    diagrams: list  # Diagram
+
+
+def normalize_path(path: str) -> str:
+    """
+    Converts a folder path to the form '/a/b', with '/' as the root folder.
+    `path` on models and diagrams must be stored in this form to be found by the queries in this module.
+    """
+    parts = [x for x in (path or '').split('/') if x]
+    return ROOT + '/'.join(parts)
+
+
+def parent_path(path: str) -> str:
+    path = normalize_path(path)
+    return normalize_path(path.rsplit('/', 1)[0])
+
+
+def subtree_regex(path: str) -> str:
+    """
+    Anchored regex matching the folder and all folders below it.
+    Being anchored to a literal prefix, it can be answered by an index on `path`.
+    """
+    path = normalize_path(path)
+    if path == ROOT:
+        return '^/'
+    return f'^{re.escape(path)}(/|$)'
+
+
+def _path_condition(path: str, recursive: bool):
+    if recursive:
+        return {'$regex': subtree_regex(path)}
+    return normalize_path(path)
+
+
+def list_folder(repository: Repository,
+                project_id: ObjectId,
+                path: str = ROOT,
+                recursive: bool = False) -> FolderListing:
+    """
+    Lists the content of a folder in a project with a single aggregation over models, diagrams and the project.
+    :param repository: repository to query
+    :param project_id: id of the project
+    :param path: path of the folder
+    :param recursive: if True, includes models and diagrams in all folders below `path`
+    :return: the folder content
+    """
+    path = normalize_path(path)
+    match = {'projectId': project_id, 'path': _path_condition(path, recursive)}
+    results = repository.aggregate(Collection.MODEL, [
+        {'$match': match},
+        {'$addFields': {'_source': Collection.MODEL.value}},
+        {'$unionWith': {'coll': Collection.DIAGRAM.value, 'pipeline': [
+            {'$match': match},
+            {'$addFields': {'_source': Collection.DIAGRAM.value}}
+        ]}},
+        {'$unionWith': {'coll': Collection.PROJECT.value, 'pipeline': [
+            {'$match': {'_id': project_id}},
+            {'$project': {'folders': 1, '_source': Collection.PROJECT.value}}
+        ]}}
+    ])
+
+    listing = FolderListing(path, [], [], [])
+    for item in results:
+        source = item.pop('_source')
+        if source == Collection.MODEL.value:
+            listing.models.append(Model.from_dict(item))
+        elif source == Collection.DIAGRAM.value:
+            listing.diagrams.append(Diagram.from_dict(item))
+        else:
+            folders = {normalize_path(x) for x in item.get('folders') or []}
+            listing.folders = sorted(x for x in folders if x != path and parent_path(x) == path)
+    return listing
+
+
+def create_folder(repository: Repository, project_id: ObjectId, path: str) -> bool:
+    """
+    Adds a folder and any missing parent folders to a project.
+    :return: True if the project was modified
+    """
+    path = normalize_path(path)
+    folders = []
+    while path != ROOT:
+        folders.insert(0, path)
+        path = parent_path(path)
+    if not folders:
+        return False
+    return repository.push_list(Collection.PROJECT, project_id, 'folders', folders)
+
+
+def move_folder(repository: Repository, project_id: ObjectId, path: str, new_path: str) -> dict:
+    """
+    Moves or renames a folder with everything below it.
+    Models and diagrams are rewritten server-side with one `update_many` per collection.
+    :param repository: repository to query
+    :param project_id: id of the project
+    :param path: current path of the folder
+    :param new_path: new path of the folder, moving a folder onto its own path does nothing
+    :return: number of modified documents per collection
+    """
+    path, new_path = normalize_path(path), normalize_path(new_path)
+    if path == ROOT:
+        raise ValueError('The root folder cannot be moved')
+    if new_path == ROOT:
+        raise ValueError('A folder cannot be moved onto the root folder')
+    if new_path == path:
+        return {Collection.MODEL: 0, Collection.DIAGRAM: 0}
+    if re.match(subtree_regex(path), new_path):
+        raise ValueError('A folder cannot be moved into itself')
+
+    query = {'projectId': project_id, 'path': {'$regex': subtree_regex(path)}}
+    update = [{'$set': {'path': {'$concat': [
+        new_path,
+        {'$substrCP': ['$path', len(path), {'$strLenCP': '$path'}]}
+    ]}}}]
+    counts = {collection: repository.update_many(collection, query, update)
+              for collection in (Collection.MODEL, Collection.DIAGRAM)}
+
+    project = repository.find_one(Collection.PROJECT, _id=project_id)
+    if project is not None:
+        folders = []
+        for folder in project.get('folders') or []:
+            folder = normalize_path(folder)
+            if re.match(subtree_regex(path), folder):
+                folder = new_path + folder[len(path):]
+            if folder not in folders:
+                folders.append(folder)
+        repository.update_many(Collection.PROJECT, {'_id': project_id}, {'$set': {'folders': folders}})
+        create_folder(repository, project_id, new_path)
+    return counts
+
+
+def rename_folder(repository: Repository, project_id: ObjectId, path: str, name: str) -> dict:
+    """
+    Renames the last segment of a folder path. See `move_folder`.
+    """
+    if not name or '/' in name:
+        raise ValueError('Folder names must be non-empty and cannot contain /')
+    parent = parent_path(path)
+    return move_folder(repository, project_id, path, f'{parent.rstrip("/")}/{name}')
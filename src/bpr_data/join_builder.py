@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+from typing import Type
+
+from bson.objectid import ObjectId
+
+from .models.invitation import InvitationGetModel
+from .repository import Collection, Repository, T
+
+
+class JoinBuilder:
+    """
+    Builds a single aggregation joining any number of collections.
+
+    Lookups join on `localField`/`foreignField`, so MongoDB can use the index on the foreign field,
+    with a sub-pipeline projecting only the requested foreign fields. Results can be cast directly to a return type.
+    Lookups combining `localField`/`foreignField` with a pipeline require MongoDB 5.0 or newer.
+
+    Example, building an `InvitationGetModel`:
+
+    JoinBuilder(Collection.INVITATION) \\
+        .match(inviteeEmailAddress=email) \\
+        .lookup_fields(Collection.USER, 'inviterId', '_id', inviterUserName='name') \\
+        .lookup_fields(Collection.WORKSPACE, 'workspaceId', '_id', workspaceName='name') \\
+        .execute(repository, InvitationGetModel)
+    """
+
+    def __init__(self, collection: Collection):
+        """
+        :param collection: collection the results are taken from
+        """
+        self.collection = collection
+        self._stages = []
+        self._temporary_fields = 0
+
+    def match(self, **match_args) -> JoinBuilder:
+        """
+        Filters the documents. Place before the lookups to filter the local collection before joining.
+        A special parameter, `id`, will automatically be converted from string to ObjectId and be used as `_id`.
+        :param match_args: search params in key-value form
+        """
+        if 'id' in match_args:
+            if match_args['id'] is not None:
+                match_args['_id'] = ObjectId(match_args['id'])
+            del match_args['id']
+        if match_args:
+            self._stages.append({'$match': match_args})
+        return self
+
+    def lookup(self,
+               foreign_collection: Collection,
+               local_field: str,
+               foreign_field: str,
+               to_field: str,
+               fields: list = None,
+               unwind: bool = False,
+               preserve_null_and_empty_arrays: bool = True) -> JoinBuilder:
+        """
+        Adds the matching documents in `foreign_collection` as sub-documents. Equivalent to a left outer join.
+        :param foreign_collection: collection to join
+        :param local_field: field to join on in the local documents, may be a list of values, ex: 'users.userId'
+        :param foreign_field: field to join on in the foreign collection
+        :param to_field: field containing the results of the join
+        :param fields: Optional! foreign fields to fetch, `_id` is always included. Fetches whole documents if omitted
+        :param unwind: if true, unwinds on `to_field`
+        :param preserve_null_and_empty_arrays: if unwinding, keeps documents without matches
+        """
+        lookup = {
+            'from': foreign_collection.value,
+            'localField': local_field,
+            'foreignField': foreign_field,
+            'as': to_field
+        }
+        if fields:
+            lookup['pipeline'] = [{'$project': {x: 1 for x in fields}}]
+        self._stages.append({'$lookup': lookup})
+        if unwind:
+            self.unwind(to_field, preserve_null_and_empty_arrays)
+        return self
+
+    def lookup_fields(self,
+                      foreign_collection: Collection,
+                      local_field: str,
+                      foreign_field: str,
+                      **fields) -> JoinBuilder:
+        """
+        Copies fields of the first matching foreign document onto the local documents.
+        Fields are set to None when there is no match.
+        :param foreign_collection: collection to join
+        :param local_field: field to join on in the local documents
+        :param foreign_field: field to join on in the foreign collection
+        :param fields: local field names mapped to the foreign fields to copy, ex: inviterUserName='name'
+        """
+        temporary_field = f'_joined{self._temporary_fields}'
+        self._temporary_fields += 1
+        self.lookup(foreign_collection, local_field, foreign_field, temporary_field, list(fields.values()))
+        # $arrayElemAt of an empty list is missing rather than null, which would leave the field out
+        self.add_fields(**{k: {'$ifNull': [{'$arrayElemAt': [f'${temporary_field}.{v}', 0]}, None]}
+                           for k, v in fields.items()})
+        self._stages.append({'$unset': temporary_field})
+        return self
+
+    def unwind(self, field: str, preserve_null_and_empty_arrays: bool = True) -> JoinBuilder:
+        """
+        Outputs a document for each element in the list in `field`.
+        :param field: field to unwind
+        :param preserve_null_and_empty_arrays: if True, keeps documents where the field is missing, null or empty
+        """
+        self._stages.append({'$unwind': {
+            'path': f'${field}',
+            'preserveNullAndEmptyArrays': preserve_null_and_empty_arrays
+        }})
+        return self
+
+    def add_fields(self, **fields) -> JoinBuilder:
+        """
+        Adds or replaces fields, ex: add_fields(inviterName='$inviter.name')
+        """
+        self._stages.append({'$addFields': fields})
+        return self
+
+    def project(self, *fields, **computed) -> JoinBuilder:
+        """
+        Keeps only the given fields. Computed fields can be added as keyword arguments.
+        """
+        spec = {x: 1 for x in fields}
+        spec.update(computed)
+        self._stages.append({'$project': spec})
+        return self
+
+    def pipeline(self) -> list:
+        return list(self._stages)
+
+    def execute(self, repository: Repository, return_type: Type[T] = None) -> list:
+        """
+        Runs the aggregation.
+        :param repository: repository to query
+        :param return_type: Optional! Subclass of SerializableObject to cast result to
+        :return: list of resulting documents
+        """
+        return repository.aggregate(self.collection, self.pipeline(), return_type)
+
+
+def find_invitations(repository: Repository, **match_args) -> list:
+    """
+    Finds invitations with the name of the inviter and the workspace in a single aggregation.
+    :param repository: repository to query
+    :param match_args: search params in key-value form, ex: inviteeEmailAddress='a@b.com'
+    :return: list of InvitationGetModel
+    """
+    return JoinBuilder(Collection.INVITATION) \
+        .match(**match_args) \
+        .lookup_fields(Collection.USER, 'inviterId', '_id', inviterUserName='name') \
+        .lookup_fields(Collection.WORKSPACE, 'workspaceId', '_id', workspaceName='name') \
+        .execute(repository, InvitationGetModel)
@@ -0,0 +1,1146 @@
+from __future__ import annotations
+
+import copy
+import functools
+import re
+from contextlib import contextmanager
+from datetime import datetime
+
+from bson.objectid import ObjectId
+from pymongo.errors import DuplicateKeyError, WriteError
+from pymongo.results import DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+_MISSING = object()
+_UNHASHABLE = object()
+
+
+class MemoryClient:
+    """
+    Pure-Python stand-in for `pymongo.MongoClient`.
+
+    Implements the subset of the client, database and collection API that `Repository` relies on,
+    so code built on `Repository` can be tested and benchmarked without a running MongoDB.
+    Documents are kept in dicts in process memory and are lost when the client is discarded.
+    """
+
+    def __init__(self, default_db: str = 'test', indexes: dict = None):
+        """
+        :param default_db: name of the database returned by `get_default_database`
+        :param indexes: Optional! mapping of collection name to a list of fields to hash index
+        """
+        self._default_db = default_db
+        self._databases = {}
+        for collection_name, fields in (indexes or {}).items():
+            for field in fields:
+                self.get_default_database()[collection_name].create_index(field)
+
+    def get_default_database(self) -> MemoryDatabase:
+        return self.get_database(self._default_db)
+
+    def get_database(self, name: str) -> MemoryDatabase:
+        if name not in self._databases:
+            self._databases[name] = MemoryDatabase(self, name)
+        return self._databases[name]
+
+    def __getitem__(self, name: str) -> MemoryDatabase:
+        return self.get_database(name)
+
+    def start_session(self, **kwargs) -> MemorySession:
+        return MemorySession(self)
+
+    def close(self):
+        pass
+
+    def _snapshot(self) -> dict:
+        return {(database.name, name): collection._state()
+                for database in self._databases.values()
+                for name, collection in database._collections.items()}
+
+    def _restore(self, snapshot: dict):
+        for database in self._databases.values():
+            for name in list(database._collections):
+                if (database.name, name) not in snapshot:
+                    database.drop_collection(name)
+        for (database_name, name), state in snapshot.items():
+            self.get_database(database_name)[name]._restore_state(state)
+
+
+class MemorySession:
+    """
+    Stand-in for `pymongo.client_session.ClientSession`.
+
+    Transactions snapshot the whole client when started and restore the snapshot when aborted,
+    so writes are rolled back like in MongoDB. Transactions are not isolated from other sessions.
+    """
+
+    def __init__(self, client: MemoryClient):
+        self.client = client
+        self._snapshot = None
+
+    def __enter__(self) -> MemorySession:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.end_session()
+
+    @property
+    def in_transaction(self) -> bool:
+        return self._snapshot is not None
+
+    @contextmanager
+    def start_transaction(self, **kwargs):
+        if self.in_transaction:
+            raise RuntimeError('Transaction already in progress')
+        self._snapshot = self.client._snapshot()
+        try:
+            yield self
+        except BaseException:
+            self.abort_transaction()
+            raise
+        else:
+            self.commit_transaction()
+
+    def commit_transaction(self):
+        self._snapshot = None
+
+    def abort_transaction(self):
+        if self._snapshot is not None:
+            self.client._restore(self._snapshot)
+            self._snapshot = None
+
+    def with_transaction(self, callback, **kwargs):
+        with self.start_transaction():
+            return callback(self)
+
+    def end_session(self):
+        self.abort_transaction()
+
+
+class MemoryDatabase:
+    def __init__(self, client: MemoryClient, name: str):
+        self.client = client
+        self.name = name
+        self._collections = {}
+
+    def get_collection(self, name: str) -> MemoryCollection:
+        if name not in self._collections:
+            self._collections[name] = MemoryCollection(self, name)
+        return self._collections[name]
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        return self.get_collection(name)
+
+    def list_collection_names(self) -> list:
+        return list(self._collections.keys())
+
+    def drop_collection(self, name: str):
+        self._collections.pop(name, None)
+
+
+class MemoryCursor:
+    """
+    Minimal cursor over a materialized result list.
+    Supports the chaining methods used with pymongo cursors.
+    """
+
+    def __init__(self, documents: list):
+        self._documents = documents
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key_or_list, direction: int = 1) -> MemoryCursor:
+        keys = key_or_list if isinstance(key_or_list, list) else [(key_or_list, direction)]
+        self._documents = _sort_documents(self._documents, keys)
+        return self
+
+    def skip(self, count: int) -> MemoryCursor:
+        self._skip = count
+        return self
+
+    def limit(self, count: int) -> MemoryCursor:
+        self._limit = count
+        return self
+
+    def batch_size(self, size: int) -> MemoryCursor:
+        return self
+
+    def __iter__(self):
+        end = self._skip + self._limit if self._limit else None
+        for document in self._documents[self._skip:end]:
+            yield copy.deepcopy(document)
+
+
+def _index_key(value):
+    # True == 1 and hash(True) == hash(1) in Python, but booleans never match numbers in MongoDB
+    if isinstance(value, bool):
+        return bool, value
+    return value
+
+
+class _HashIndex:
+    """
+    Hash index on a (possibly dotted) field.
+    Array values are indexed per element, like a MongoDB multikey index.
+    """
+
+    def __init__(self, field: str, unique: bool = False):
+        self.field = field
+        self.unique = unique
+        self._parts = field.split('.')
+        self._buckets = {}
+
+    def keys_for(self, document: dict) -> set:
+        values = list(_expanded(_resolve(document, self._parts)))
+        if not values:
+            values = [None]
+        keys = set()
+        for value in values:
+            if isinstance(value, list):
+                continue
+            try:
+                hash(value)
+                keys.add(_index_key(value))
+            except TypeError:
+                keys.add(_UNHASHABLE)
+        return keys
+
+    def add(self, document_id, keys: set):
+        for key in keys:
+            self._buckets.setdefault(key, set()).add(document_id)
+
+    def remove(self, document_id, keys: set):
+        for key in keys:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(document_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def conflicts(self, document_id, keys: set) -> bool:
+        for key in keys:
+            if key is None or key is _UNHASHABLE:
+                continue
+            if self._buckets.get(key, set()) - {document_id}:
+                return True
+        return False
+
+    def lookup(self, values: list) -> set | None:
+        """
+        :return: ids of documents that may match one of `values`, or None if the index cannot answer
+        """
+        result = set(self._buckets.get(_UNHASHABLE, ()))
+        for value in values:
+            if isinstance(value, (list, dict, re.Pattern)):
+                return None
+            result |= self._buckets.get(_index_key(value), set())
+        return result
+
+
+class MemoryCollection:
+    """
+    In-memory collection supporting the query, update and aggregation operators used in this package.
+    """
+
+    def __init__(self, database: MemoryDatabase, name: str):
+        self.database = database
+        self.name = name
+        self._documents = {}
+        self._sequence = {}
+        self._counter = 0
+        self._indexes = {}
+
+    # INDEXES
+
+    def create_index(self, keys, unique: bool = False, **kwargs) -> str:
+        """
+        Creates a hash index on the first field in `keys`.
+        :param keys: field name or list of (field, direction) tuples
+        :param unique: if True, rejects documents with a duplicate value for the field
+        :return: name of the index
+        """
+        field = keys if isinstance(keys, str) else keys[0][0]
+        name = kwargs.get('name', f'{field}_1')
+        if field == '_id' or field in self._indexes:
+            return name
+        index = _HashIndex(field, unique)
+        for document_id, document in self._documents.items():
+            keys_ = index.keys_for(document)
+            if unique and index.conflicts(document_id, keys_):
+                raise DuplicateKeyError(f'E11000 duplicate key error collection: {self.name} index: {name}')
+            index.add(document_id, keys_)
+        self._indexes[field] = index
+        return name
+
+    def index_information(self) -> dict:
+        info = {'_id_': {'key': [('_id', 1)]}}
+        for field, index in self._indexes.items():
+            info[f'{field}_1'] = {'key': [(field, 1)], 'unique': index.unique}
+        return info
+
+    # WRITES
+
+    def insert_one(self, document: dict, **kwargs) -> InsertOneResult:
+        self._insert(document)
+        return InsertOneResult(document['_id'], True)
+
+    def insert_many(self, documents, ordered: bool = True, **kwargs) -> InsertManyResult:
+        inserted_ids = []
+        for document in documents:
+            self._insert(document)
+            inserted_ids.append(document['_id'])
+        return InsertManyResult(inserted_ids, True)
+
+    def update_one(self, filter: dict, update, upsert: bool = False, **kwargs) -> UpdateResult:
+        return self._update(filter, update, upsert, multi=False)
+
+    def update_many(self, filter: dict, update, upsert: bool = False, **kwargs) -> UpdateResult:
+        return self._update(filter, update, upsert, multi=True)
+
+    def replace_one(self, filter: dict, replacement: dict, upsert: bool = False, **kwargs) -> UpdateResult:
+        for document_id in self._matching_ids(filter):
+            replacement = dict(replacement, _id=document_id)
+            modified = self._replace(document_id, copy.deepcopy(replacement))
+            return UpdateResult({'n': 1, 'nModified': int(modified)}, True)
+        if upsert:
+            self._insert(replacement)
+            return UpdateResult({'n': 1, 'nModified': 0, 'upserted': replacement['_id']}, True)
+        return UpdateResult({'n': 0, 'nModified': 0}, True)
+
+    def delete_one(self, filter: dict, **kwargs) -> DeleteResult:
+        for document_id in self._matching_ids(filter):
+            self._remove(document_id)
+            return DeleteResult({'n': 1}, True)
+        return DeleteResult({'n': 0}, True)
+
+    def delete_many(self, filter: dict, **kwargs) -> DeleteResult:
+        document_ids = list(self._matching_ids(filter))
+        for document_id in document_ids:
+            self._remove(document_id)
+        return DeleteResult({'n': len(document_ids)}, True)
+
+    def drop(self, **kwargs):
+        self.database.drop_collection(self.name)
+
+    # READS
+
+    def find(self, filter: dict = None, projection: dict = None, **kwargs) -> MemoryCursor:
+        documents = [self._documents[x] for x in self._matching_ids(filter or {})]
+        if projection:
+            documents = [_project(x, projection, {}) for x in documents]
+        return MemoryCursor(documents)
+
+    def find_one(self, filter: dict = None, projection: dict = None, **kwargs) -> dict | None:
+        for document_id in self._matching_ids(filter or {}):
+            document = self._documents[document_id]
+            if projection:
+                return _project(document, projection, {})
+            return copy.deepcopy(document)
+        return None
+
+    def distinct(self, key: str, filter: dict = None, **kwargs) -> list:
+        values = []
+        seen = set()
+        parts = key.split('.')
+        for document_id in self._matching_ids(filter or {}):
+            for value in _expanded(_resolve(self._documents[document_id], parts)):
+                if isinstance(value, list):
+                    continue
+                if _hashable(value):
+                    if value in seen:
+                        continue
+                    seen.add(value)
+                elif value in values:
+                    continue
+                values.append(value)
+        return copy.deepcopy(values)
+
+    def count_documents(self, filter: dict, **kwargs) -> int:
+        return sum(1 for _ in self._matching_ids(filter))
+
+    def aggregate(self, pipeline: list, **kwargs) -> MemoryCursor:
+        return MemoryCursor(self._aggregate(pipeline, {}))
+
+    # INTERNALS
+
+    def _state(self) -> tuple:
+        return copy.deepcopy(self._documents), dict(self._sequence), self._counter, copy.deepcopy(self._indexes)
+
+    def _restore_state(self, state: tuple):
+        documents, sequence, counter, indexes = state
+        self._documents, self._sequence, self._counter, self._indexes = documents, sequence, counter, indexes
+
+    def _insert(self, document: dict):
+        if '_id' not in document:
+            document['_id'] = ObjectId()
+        document_id = document['_id']
+        if document_id in self._documents:
+            raise DuplicateKeyError(f'E11000 duplicate key error collection: {self.name} index: _id_')
+        stored = {'_id': document_id}
+        stored.update(copy.deepcopy(document))
+        index_keys = self._index_keys(document_id, stored)
+        self._documents[document_id] = stored
+        self._counter += 1
+        self._sequence[document_id] = self._counter
+        for field, keys in index_keys.items():
+            self._indexes[field].add(document_id, keys)
+
+    def _replace(self, document_id, new_document: dict) -> bool:
+        old_document = self._documents[document_id]
+        if _identical(new_document, old_document):
+            return False
+        new_keys = self._index_keys(document_id, new_document)
+        for field, index in self._indexes.items():
+            index.remove(document_id, index.keys_for(old_document))
+            index.add(document_id, new_keys[field])
+        self._documents[document_id] = new_document
+        return True
+
+    def _remove(self, document_id):
+        document = self._documents.pop(document_id)
+        del self._sequence[document_id]
+        for index in self._indexes.values():
+            index.remove(document_id, index.keys_for(document))
+
+    def _index_keys(self, document_id, document: dict) -> dict:
+        index_keys = {}
+        for field, index in self._indexes.items():
+            keys = index.keys_for(document)
+            if index.unique and index.conflicts(document_id, keys):
+                raise DuplicateKeyError(f'E11000 duplicate key error collection: {self.name} index: {field}_1')
+            index_keys[field] = keys
+        return index_keys
+
+    def _update(self, filter: dict, update, upsert: bool, multi: bool) -> UpdateResult:
+        matched = 0
+        modified = 0
+        for document_id in list(self._matching_ids(filter)):
+            new_document = copy.deepcopy(self._documents[document_id])
+            new_document = _apply_update(new_document, update, filter)
+            matched += 1
+            if self._replace(document_id, new_document):
+                modified += 1
+            if not multi:
+                break
+        if matched == 0 and upsert:
+            document = {k: v for k, v in filter.items() if not k.startswith('$') and not _is_operator_dict(v)}
+            document = _apply_update(document, update, filter)
+            self._insert(document)
+            return UpdateResult({'n': 1, 'nModified': 0, 'upserted': document['_id']}, True)
+        return UpdateResult({'n': matched, 'nModified': modified}, True)
+
+    def _matching_ids(self, filter: dict, variables: dict = None):
+        """
+        Yields ids of stored documents matching `filter` in insertion order.
+        Uses the `_id` lookup or a hash index to narrow the candidates when possible.
+        """
+        variables = variables or {}
+        candidates = self._candidate_ids(filter, variables)
+        if candidates is None:
+            candidates = list(self._documents.keys())
+        for document_id in candidates:
+            document = self._documents.get(document_id)
+            if document is not None and _match(document, filter, variables):
+                yield document_id
+
+    def _candidate_ids(self, filter: dict, variables: dict) -> list | None:
+        best = None
+        for field, values in _equality_conditions(filter, variables):
+            if field == '_id':
+                ids = {x for x in values if _hashable(x) and x in self._documents}
+            elif field in self._indexes:
+                ids = self._indexes[field].lookup(values)
+                if ids is None:
+                    continue
+            else:
+                continue
+            best = ids if best is None else best & ids
+        if best is None:
+            return None
+        return sorted(best, key=self._sequence.get)
+
+    def _aggregate(self, pipeline: list, variables: dict, source: list = None) -> list:
+        stages = list(pipeline)
+        if source is None:
+            query = {}
+            if stages and '$match' in stages[0]:
+                query = stages.pop(0)['$match']
+            source = [self._documents[x] for x in self._matching_ids(query, variables)]
+        documents = [copy.deepcopy(x) for x in source]
+        for stage in stages:
+            (operator, spec), = stage.items()
+            documents = self._run_stage(operator, spec, documents, variables)
+        return documents
+
+    def _run_stage(self, operator: str, spec, documents: list, variables: dict) -> list:
+        if operator == '$match':
+            return [x for x in documents if _match(x, spec, variables)]
+        if operator == '$lookup':
+            return [self._lookup(x, spec, variables) for x in documents]
+        if operator == '$graphLookup':
+            return [self._graph_lookup(x, spec, variables) for x in documents]
+        if operator == '$unwind':
+            return _unwind(documents, spec)
+        if operator == '$project':
+            return [_project(x, spec, variables) for x in documents]
+        if operator in ('$addFields', '$set'):
+            return [_add_fields(x, spec, variables) for x in documents]
+        if operator == '$unset':
+            fields = [spec] if isinstance(spec, str) else spec
+            return [_project(x, {f: 0 for f in fields}, variables) for x in documents]
+        if operator == '$unionWith':
+            if isinstance(spec, str):
+                spec = {'coll': spec}
+            return documents + self.database[spec['coll']]._aggregate(spec.get('pipeline', []), variables)
+        if operator == '$replaceRoot':
+            return [_evaluate(spec['newRoot'], x, variables) for x in documents]
+        if operator == '$sort':
+            return _sort_documents(documents, list(spec.items()))
+        if operator == '$skip':
+            return documents[spec:]
+        if operator == '$limit':
+            return documents[:spec]
+        if operator == '$count':
+            return [{spec: len(documents)}] if documents else []
+        raise ValueError(f'Unsupported aggregation stage: {operator}')
+
+    def _lookup(self, document: dict, spec: dict, variables: dict) -> dict:
+        foreign = self.database[spec['from']]
+        query = {}
+        if 'localField' in spec:
+            local_values = list(_expanded(_resolve(document, spec['localField'].split('.')))) or [None]
+            query = {spec['foreignField']: {'$in': local_values}}
+        if 'pipeline' in spec:
+            let = {name: _null_if_missing(_evaluate(expr, document, variables))
+                   for name, expr in spec.get('let', {}).items()}
+            pipeline = spec['pipeline']
+            if query:
+                pipeline = [{'$match': query}] + pipeline
+            matched = foreign._aggregate(pipeline, dict(variables, **let))
+        else:
+            matched = [copy.deepcopy(foreign._documents[x]) for x in foreign._matching_ids(query)]
+        _set_path(document, spec['as'], matched)
+        return document
+
+    def _graph_lookup(self, document: dict, spec: dict, variables: dict) -> dict:
+        foreign = self.database[spec['from']]
+        start = _null_if_missing(_evaluate(spec['startWith'], document, variables))
+        values = start if isinstance(start, list) else [start]
+        max_depth = spec.get('maxDepth')
+        restrict = spec.get('restrictSearchWithMatch', {})
+        from_parts = spec['connectFromField'].split('.')
+        found = {}
+        depth = 0
+        while values and (max_depth is None or depth <= max_depth):
+            query = dict(restrict, **{spec['connectToField']: {'$in': values}})
+            next_values = []
+            for document_id in foreign._matching_ids(query, variables):
+                if document_id in found:
+                    continue
+                match = copy.deepcopy(foreign._documents[document_id])
+                if 'depthField' in spec:
+                    match[spec['depthField']] = depth
+                found[document_id] = match
+                next_values.extend(x for x in _expanded(_resolve(match, from_parts)) if not isinstance(x, list))
+            values = next_values
+            depth += 1
+        _set_path(document, spec['as'], list(found.values()))
+        return document
+
+
+# QUERY MATCHING
+
+def _hashable(value) -> bool:
+    try:
+        hash(value)
+        return True
+    except TypeError:
+        return False
+
+
+def _is_operator_dict(value) -> bool:
+    return isinstance(value, dict) and len(value) > 0 and all(k.startswith('$') for k in value)
+
+
+def _resolve(value, parts: list) -> list:
+    """
+    Collects every value reachable through the dotted path `parts`, descending into arrays.
+    """
+    if not parts:
+        return [value]
+    head, rest = parts[0], parts[1:]
+    if isinstance(value, dict):
+        if head in value:
+            return _resolve(value[head], rest)
+        return []
+    if isinstance(value, list):
+        found = []
+        if head.isdigit() and int(head) < len(value):
+            found.extend(_resolve(value[int(head)], rest))
+        for element in value:
+            if isinstance(element, dict):
+                found.extend(_resolve(element, parts))
+        return found
+    return []
+
+
+def _expanded(values):
+    for value in values:
+        yield value
+        if isinstance(value, list):
+            yield from value
+
+
+def _equality_conditions(filter: dict, variables: dict):
+    """
+    Yields (field, candidate values) for the top-level conditions of `filter` that can be answered by an index.
+    """
+    for key, condition in filter.items():
+        if key == '$and':
+            for sub_filter in condition:
+                yield from _equality_conditions(sub_filter, variables)
+        elif key == '$expr':
+            if isinstance(condition, dict) and len(condition) == 1:
+                (operator, args), = condition.items()
+                if operator in ('$eq', '$in') and isinstance(args, list) and len(args) == 2:
+                    field, variable = args
+                    if isinstance(field, str) and field.startswith('$') and not field.startswith('$$') \
+                            and _is_constant(variable):
+                        value = _null_if_missing(_evaluate(variable, {}, variables))
+                        if operator == '$in':
+                            if isinstance(value, list):
+                                yield field[1:], value
+                        elif not isinstance(value, list):
+                            yield field[1:], [value]
+        elif key.startswith('$'):
+            continue
+        elif _is_operator_dict(condition):
+            if '$eq' in condition:
+                yield key, [condition['$eq']]
+            elif '$in' in condition:
+                yield key, list(condition['$in'])
+        elif not isinstance(condition, dict):
+            yield key, [condition]
+
+
+def _is_constant(expression) -> bool:
+    """
+    True if the expression only depends on variables and literals, not on the current document.
+    """
+    if isinstance(expression, str):
+        return not expression.startswith('$') or expression.startswith('$$') and not expression.startswith('$$ROOT') \
+            and not expression.startswith('$$CURRENT')
+    if isinstance(expression, list):
+        return all(_is_constant(x) for x in expression)
+    if isinstance(expression, dict):
+        return all(_is_constant(x) for x in expression.values())
+    return True
+
+
+def _match(document: dict, query: dict, variables: dict = None) -> bool:
+    for key, condition in query.items():
+        if key == '$and':
+            if not all(_match(document, x, variables) for x in condition):
+                return False
+        elif key == '$or':
+            if not any(_match(document, x, variables) for x in condition):
+                return False
+        elif key == '$nor':
+            if any(_match(document, x, variables) for x in condition):
+                return False
+        elif key == '$expr':
+            if not _truthy(_evaluate(condition, document, variables or {})):
+                return False
+        elif key == '$comment':
+            continue
+        elif key.startswith('$'):
+            raise ValueError(f'Unsupported query operator: {key}')
+        elif not _match_field(document, key, condition):
+            return False
+    return True
+
+
+def _match_field(document: dict, path: str, condition) -> bool:
+    values = _resolve(document, path.split('.'))
+    if _is_operator_dict(condition):
+        options = condition.get('$options', '')
+        return all(_match_operator(values, op, arg, options) for op, arg in condition.items() if op != '$options')
+    return _match_operator(values, '$eq', condition, '')
+
+
+def _match_element(element, condition) -> bool:
+    if _is_operator_dict(condition):
+        options = condition.get('$options', '')
+        return all(_match_operator([element], op, arg, options) for op, arg in condition.items() if op != '$options')
+    if isinstance(element, dict) and isinstance(condition, dict):
+        return _match(element, condition)
+    return _values_equal(element, condition)
+
+
+def _values_equal(a, b) -> bool:
+    """
+    BSON equality. Unlike Python, booleans never equal numbers.
+    """
+    if isinstance(a, bool) or isinstance(b, bool):
+        return isinstance(a, bool) and isinstance(b, bool) and a == b
+    if isinstance(a, dict) and isinstance(b, dict):
+        return list(a.keys()) == list(b.keys()) and all(_values_equal(a[k], b[k]) for k in a)
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(_values_equal(x, y) for x, y in zip(a, b))
+    return a == b
+
+
+def _identical(a, b) -> bool:
+    """
+    Stricter than `_values_equal`, values of different types always differ, ex: 1 and 1.0,
+    as writing either changes the stored BSON type.
+    """
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, dict):
+        return list(a.keys()) == list(b.keys()) and all(_identical(a[k], b[k]) for k in a)
+    if isinstance(a, list):
+        return len(a) == len(b) and all(_identical(x, y) for x, y in zip(a, b))
+    return a == b
+
+
+def _equals_any(values: list, expected) -> bool:
+    if isinstance(expected, re.Pattern):
+        return any(isinstance(x, str) and expected.search(x) for x in _expanded(values))
+    if not values:
+        return expected is None
+    for value in values:
+        if _values_equal(value, expected):
+            return True
+        if isinstance(value, list) and any(_values_equal(x, expected) for x in value):
+            return True
+    return False
+
+
+def _match_operator(values: list, operator: str, arg, options: str) -> bool:
+    if operator == '$eq':
+        return _equals_any(values, arg)
+    if operator == '$ne':
+        return not _equals_any(values, arg)
+    if operator == '$in':
+        return any(_equals_any(values, x) for x in arg)
+    if operator == '$nin':
+        return not any(_equals_any(values, x) for x in arg)
+    if operator in ('$gt', '$gte', '$lt', '$lte'):
+        for value in _expanded(values):
+            result = _compare(value, arg, strict=True)
+            if result is None:
+                continue
+            if (operator == '$gt' and result > 0) or (operator == '$gte' and result >= 0) \
+                    or (operator == '$lt' and result < 0) or (operator == '$lte' and result <= 0):
+                return True
+        return False
+    if operator == '$exists':
+        return bool(values) == bool(arg)
+    if operator == '$regex':
+        pattern = arg if isinstance(arg, re.Pattern) else re.compile(arg, _regex_flags(options))
+        return any(isinstance(x, str) and pattern.search(x) for x in _expanded(values))
+    if operator == '$elemMatch':
+        return any(isinstance(x, list) and any(_match_element(e, arg) for e in x) for x in values)
+    if operator == '$all':
+        return all(_equals_any(values, x) for x in arg)
+    if operator == '$size':
+        return any(isinstance(x, list) and len(x) == arg for x in values)
+    if operator == '$not':
+        if isinstance(arg, dict):
+            sub_options = arg.get('$options', '')
+            return not all(_match_operator(values, op, a, sub_options) for op, a in arg.items() if op != '$options')
+        return not _match_operator(values, '$regex', arg, '')
+    raise ValueError(f'Unsupported query operator: {operator}')
+
+
+def _regex_flags(options: str) -> int:
+    flags = 0
+    if 'i' in options:
+        flags |= re.IGNORECASE
+    if 'm' in options:
+        flags |= re.MULTILINE
+    if 's' in options:
+        flags |= re.DOTALL
+    if 'x' in options:
+        flags |= re.VERBOSE
+    return flags
+
+
+def _type_order(value) -> int:
+    """
+    Approximates the BSON comparison order between types.
+    """
+    if value is None:
+        return 0
+    if isinstance(value, bool):
+        return 7
+    if isinstance(value, (int, float)):
+        return 1
+    if isinstance(value, str):
+        return 2
+    if isinstance(value, dict):
+        return 3
+    if isinstance(value, list):
+        return 4
+    if isinstance(value, ObjectId):
+        return 6
+    if isinstance(value, datetime):
+        return 8
+    return 9
+
+
+def _compare(a, b, strict: bool = False) -> int | None:
+    """
+    Compares two values. Returns None for values of different types if `strict` is True,
+    as query operators never match across types.
+    """
+    order_a, order_b = _type_order(a), _type_order(b)
+    if order_a != order_b:
+        if strict:
+            return None
+        return -1 if order_a < order_b else 1
+    if order_a in (3, 4, 9):
+        a, b = str(a), str(b)
+    if a == b:
+        return 0
+    return -1 if a < b else 1
+
+
+def _sort_documents(documents: list, keys: list) -> list:
+    documents = list(documents)
+    for field, direction in reversed(keys):
+        parts = field.split('.')
+
+        def sort_key(document, parts=parts):
+            values = _resolve(document, parts)
+            value = values[0] if values else None
+            return _type_order(value), value if _type_order(value) not in (3, 4, 9) else str(value)
+
+        documents.sort(key=sort_key, reverse=direction < 0)
+    return documents
+
+
+# EXPRESSIONS
+
+def _truthy(value) -> bool:
+    return value is not None and value is not _MISSING and value is not False and value != 0
+
+
+def _field_value(value, path: str):
+    """
+    :return: the value at `path`, or `_MISSING` if there is none, as field paths to missing fields evaluate to
+        nothing rather than null in MongoDB
+    """
+    for part in path.split('.'):
+        if isinstance(value, dict):
+            value = value.get(part, _MISSING)
+        elif isinstance(value, list):
+            value = [_field_value(x, part) for x in value if isinstance(x, dict) and part in x]
+        else:
+            return _MISSING
+    return value
+
+
+def _null_if_missing(value):
+    return None if value is _MISSING else value
+
+
+def _evaluate(expression, document: dict, variables: dict):
+    if isinstance(expression, str):
+        if expression.startswith('$$'):
+            name, _, path = expression[2:].partition('.')
+            if name in ('ROOT', 'CURRENT'):
+                base = document
+            elif name in variables:
+                base = variables[name]
+            else:
+                raise ValueError(f'Undefined variable: {name}')
+            return _field_value(base, path) if path else base
+        if expression.startswith('$'):
+            return _field_value(document, expression[1:])
+        return expression
+    if isinstance(expression, list):
+        return [_null_if_missing(_evaluate(x, document, variables)) for x in expression]
+    if isinstance(expression, dict):
+        if len(expression) == 1:
+            (key, args), = expression.items()
+            if key.startswith('$'):
+                return _apply_expression(key, args, document, variables)
+        values = {k: _evaluate(v, document, variables) for k, v in expression.items()}
+        return {k: v for k, v in values.items() if v is not _MISSING}
+    return expression
+
+
+def _apply_expression(operator: str, args, document: dict, variables: dict):
+    if operator == '$literal':
+        return args
+    if operator == '$cond':
+        if isinstance(args, dict):
+            args = [args['if'], args['then'], args['else']]
+        branch = args[1] if _truthy(_evaluate(args[0], document, variables)) else args[2]
+        return _evaluate(branch, document, variables)
+    if operator == '$and':
+        return all(_truthy(_evaluate(x, document, variables)) for x in args)
+    if operator == '$or':
+        return any(_truthy(_evaluate(x, document, variables)) for x in args)
+
+    values = _evaluate(args if isinstance(args, list) else [args], document, variables)
+    if operator == '$ifNull':
+        return next((x for x in values if x is not None), None)
+    if operator == '$not':
+        return not _truthy(values[0])
+    if operator in ('$eq', '$ne', '$gt', '$gte', '$lt', '$lte', '$cmp'):
+        result = _compare(values[0], values[1])
+        return {'$eq': result == 0, '$ne': result != 0, '$gt': result > 0, '$gte': result >= 0,
+                '$lt': result < 0, '$lte': result <= 0, '$cmp': result}[operator]
+    if operator == '$in':
+        return any(_values_equal(x, values[0]) for x in values[1])
+    if operator == '$concat':
+        if any(x is None for x in values):
+            return None
+        return ''.join(values)
+    if operator == '$concatArrays':
+        if any(x is None for x in values):
+            return None
+        return [x for array in values for x in array]
+    if operator == '$substrCP':
+        string, start, length = values
+        return (string or '')[start:start + length]
+    if operator == '$strLenCP':
+        return len(values[0])
+    if operator == '$indexOfCP':
+        string, substring = values[0], values[1]
+        if string is None:
+            return None
+        return string.find(substring, *values[2:])
+    if operator == '$toString':
+        return None if values[0] is None else str(values[0])
+    if operator == '$size':
+        return len(values[0])
+    if operator in ('$min', '$max'):
+        if len(values) == 1 and isinstance(values[0], list):
+            values = values[0]
+        # Null and missing values are ignored
+        values = [x for x in values if x is not None]
+        if not values:
+            return None
+        select = min if operator == '$min' else max
+        return select(values, key=functools.cmp_to_key(_compare))
+    if operator == '$arrayElemAt':
+        array, index = values
+        if not isinstance(array, list):
+            return None
+        return array[index] if -len(array) <= index < len(array) else _MISSING
+    if operator in ('$add', '$subtract', '$multiply', '$divide'):
+        # Arithmetic on null or missing values returns null
+        if any(x is None for x in values):
+            return None
+        if operator == '$add':
+            return sum(values)
+        if operator == '$subtract':
+            return values[0] - values[1]
+        if operator == '$divide':
+            return values[0] / values[1]
+        result = 1
+        for value in values:
+            result *= value
+        return result
+    raise ValueError(f'Unsupported expression operator: {operator}')
+
+
+# PROJECTION AND UPDATES
+
+def _project(document: dict, spec: dict, variables: dict) -> dict:
+    inclusion = any(k != '_id' and v not in (0, False) for k, v in spec.items())
+    if not inclusion:
+        result = copy.deepcopy(document)
+        for path, value in spec.items():
+            if value in (0, False):
+                _unset_path(result, path)
+        return result
+    result = {}
+    if spec.get('_id', 1) not in (0, False) and '_id' in document:
+        result['_id'] = copy.deepcopy(document['_id'])
+    for path, value in spec.items():
+        if value in (0, False):
+            continue
+        if value is True or value == 1:
+            _include_path(document, result, path.split('.'))
+        else:
+            value = _evaluate(value, document, variables)
+            if value is not _MISSING:
+                _set_path(result, path, value)
+    return result
+
+
+def _include_path(source, target: dict, parts: list):
+    head, rest = parts[0], parts[1:]
+    if not isinstance(source, dict) or head not in source:
+        return
+    value = source[head]
+    if not rest:
+        target[head] = copy.deepcopy(value)
+    elif isinstance(value, dict):
+        _include_path(value, target.setdefault(head, {}), rest)
+    elif isinstance(value, list):
+        elements = [x for x in value if isinstance(x, dict)]
+        projected = target.get(head)
+        if not isinstance(projected, list) or len(projected) != len(elements):
+            projected = [{} for _ in elements]
+            target[head] = projected
+        for element, sub_target in zip(elements, projected):
+            _include_path(element, sub_target, rest)
+
+
+def _add_fields(document: dict, spec: dict, variables: dict) -> dict:
+    values = {k: _evaluate(v, document, variables) for k, v in spec.items()}
+    for path, value in values.items():
+        if value is not _MISSING:
+            _set_path(document, path, value)
+    return document
+
+
+def _get_path(document, path: str):
+    value = document
+    for part in path.split('.'):
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return _MISSING
+    return value
+
+
+def _set_path(document: dict, path: str, value):
+    parts = path.split('.')
+    target = document
+    for part in parts[:-1]:
+        if isinstance(target, list):
+            target = target[int(part)]
+        else:
+            if not isinstance(target.get(part), (dict, list)):
+                target[part] = {}
+            target = target[part]
+    if isinstance(target, list):
+        target[int(parts[-1])] = value
+    else:
+        target[parts[-1]] = value
+
+
+def _unset_path(document: dict, path: str):
+    parts = path.split('.')
+    parent = _get_path(document, '.'.join(parts[:-1])) if len(parts) > 1 else document
+    if isinstance(parent, dict):
+        parent.pop(parts[-1], None)
+    elif isinstance(parent, list):
+        for element in parent:
+            if isinstance(element, dict):
+                element.pop(parts[-1], None)
+
+
+def _positional_path(document: dict, path: str, query: dict) -> str:
+    """
+    Replaces the positional `$` operator in `path` with the index of the first array element matched by `query`.
+    """
+    parts = path.split('.')
+    if '$' not in parts:
+        return path
+    position = parts.index('$')
+    array_path = '.'.join(parts[:position])
+    array = _get_path(document, array_path)
+    if isinstance(array, list):
+        for key, condition in query.items():
+            if key == array_path and _is_operator_dict(condition) and '$elemMatch' in condition:
+                matches = [_match_element(x, condition['$elemMatch']) for x in array]
+            elif key.startswith(array_path + '.'):
+                sub_key = key[len(array_path) + 1:]
+                matches = [isinstance(x, dict) and _match_field(x, sub_key, condition) for x in array]
+            elif key == array_path and not _is_operator_dict(condition):
+                matches = [_values_equal(x, condition) for x in array]
+            else:
+                continue
+            if True in matches:
+                parts[position] = str(matches.index(True))
+                return '.'.join(parts)
+    raise WriteError('The positional operator did not find the match needed from the query.')
+
+
+def _apply_update(document: dict, update, query: dict) -> dict:
+    if isinstance(update, list):
+        for stage in update:
+            (operator, spec), = stage.items()
+            if operator in ('$set', '$addFields'):
+                document = _add_fields(document, spec, {})
+            elif operator in ('$unset', '$project'):
+                fields = {spec: 0} if isinstance(spec, str) else spec
+                if isinstance(fields, list):
+                    fields = {f: 0 for f in fields}
+                document = _project(document, fields, {})
+            elif operator == '$replaceRoot':
+                document = dict(_evaluate(spec['newRoot'], document, {}), _id=document['_id'])
+            else:
+                raise ValueError(f'Unsupported update pipeline stage: {operator}')
+        return document
+
+    for operator, fields in update.items():
+        for path, value in fields.items():
+            path = _positional_path(document, path, query)
+            if operator == '$set':
+                _set_path(document, path, copy.deepcopy(value))
+            elif operator == '$unset':
+                _unset_path(document, path)
+            elif operator == '$inc':
+                current = _get_path(document, path)
+                _set_path(document, path, (0 if current is _MISSING else current) + value)
+            elif operator in ('$push', '$addToSet'):
+                items = value['$each'] if isinstance(value, dict) and '$each' in value else [value]
+                array = _get_path(document, path)
+                if array is _MISSING:
+                    array = []
+                    _set_path(document, path, array)
+                if not isinstance(array, list):
+                    raise WriteError(f'The field \'{path}\' must be an array.')
+                for item in items:
+                    if operator == '$push' or not any(_values_equal(x, item) for x in array):
+                        array.append(copy.deepcopy(item))
+            elif operator == '$pull':
+                array = _get_path(document, path)
+                if isinstance(array, list):
+                    array[:] = [x for x in array if not _match_element(x, value)]
+            else:
+                raise ValueError(f'Unsupported update operator: {operator}')
+    return document
+
+
+def _unwind(documents: list, spec) -> list:
+    if isinstance(spec, str):
+        spec = {'path': spec}
+    path = spec['path'][1:]
+    preserve = spec.get('preserveNullAndEmptyArrays', False)
+    index_field = spec.get('includeArrayIndex')
+    result = []
+    for document in documents:
+        value = _get_path(document, path)
+        if isinstance(value, list) and value:
+            # Every output gets its own copy, so later stages writing nested fields cannot affect siblings
+            for index, element in enumerate(value):
+                unwound = copy.deepcopy(document)
+                _set_path(unwound, path, copy.deepcopy(element))
+                if index_field:
+                    unwound[index_field] = index
+                result.append(unwound)
+        elif isinstance(value, list) or value is _MISSING or value is None:
+            if preserve:
+                document = copy.deepcopy(document)
+                if isinstance(value, list):
+                    _unset_path(document, path)
+                if index_field:
+                    document[index_field] = None
+                result.append(document)
+        else:
+            document = copy.deepcopy(document)
+            if index_field:
+                document[index_field] = None
+            result.append(document)
+    return result
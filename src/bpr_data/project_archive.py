@@ -0,0 +1,250 @@
+from __future__ import annotations
+
+import gzip
+from datetime import datetime, timezone
+
+import bson
+from bson.objectid import ObjectId
+
+from .repository import Collection, Repository
+
+ARCHIVE_FORMAT = 'bpr-project-archive'
+ARCHIVE_VERSION = 1
+_GZIP_MAGIC = b'\x1f\x8b'
+
+
+class _IdMap:
+    """
+    Maps old ids to new ids, creating new ids on first use.
+    Lazily creating ids allows references to be remapped before the referenced document is seen in a stream.
+    """
+
+    def __init__(self):
+        self._ids = {}
+
+    def __call__(self, old_id):
+        if old_id is None:
+            return None
+        if old_id not in self._ids:
+            self._ids[old_id] = ObjectId()
+        return self._ids[old_id]
+
+
+def _remap_relation(relation, ids: _IdMap):
+    # Returns a copy, as the same relation dict may also be referenced from the history
+    if isinstance(relation, dict) and 'target' in relation:
+        return dict(relation, target=ids(relation['target']))
+    return relation
+
+
+def _remap(collection: Collection, document: dict, ids: _IdMap) -> dict:
+    """
+    Gives a document of a project a new id and remaps its references to other documents of the project.
+    Ids of nested items, such as attributes and relations, are kept.
+    """
+    document['_id'] = ids(document['_id'])
+    if collection == Collection.DIAGRAM:
+        document['projectId'] = ids(document['projectId'])
+        document['models'] = [ids(x) for x in document.get('models') or []]
+    elif collection == Collection.MODEL:
+        document['projectId'] = ids(document['projectId'])
+        document['relations'] = [_remap_relation(x, ids) for x in document.get('relations') or []]
+        for action in document.get('history') or []:
+            for field in ('item', 'oldItem', 'newItem'):
+                if field in action:
+                    action[field] = _remap_relation(action[field], ids)
+    elif collection == Collection.MODEL_REPRESENTATION:
+        document['modelId'] = ids(document['modelId'])
+        document['diagramId'] = ids(document['diagramId'])
+    return document
+
+
+def _project_documents(repository: Repository, project_id: ObjectId, batch_size: int, session=None):
+    """
+    Streams the project followed by its models, diagrams and model representations as (Collection, document).
+    """
+    project = next(repository.iterate(Collection.PROJECT, {'_id': project_id}, 1, session), None)
+    if project is None:
+        raise KeyError(f'Project {project_id} not found')
+    yield Collection.PROJECT, project
+    for collection in (Collection.MODEL, Collection.DIAGRAM):
+        for document in repository.iterate(collection, {'projectId': project_id}, batch_size, session):
+            yield collection, document
+    diagram_ids = repository.distinct(Collection.DIAGRAM, '_id', {'projectId': project_id}, session)
+    for i in range(0, len(diagram_ids), batch_size):
+        query = {'diagramId': {'$in': diagram_ids[i:i + batch_size]}}
+        for document in repository.iterate(Collection.MODEL_REPRESENTATION, query, batch_size, session):
+            yield Collection.MODEL_REPRESENTATION, document
+
+
+def _write_batches(repository: Repository, documents, batch_size: int, session=None) -> ObjectId:
+    """
+    Inserts a stream of (Collection, document) with one `insert_many` per batch.
+    The project document is written last, so a project is never visible before its contents are complete.
+    :return: id of the inserted project
+    """
+    projects = []
+    batch = []
+    batch_collection = None
+    for collection, document in documents:
+        if collection == Collection.PROJECT:
+            projects.append(document)
+            continue
+        if batch and (collection != batch_collection or len(batch) >= batch_size):
+            repository.insert_many(batch_collection, batch, session)
+            batch = []
+        batch_collection = collection
+        batch.append(document)
+    if batch:
+        repository.insert_many(batch_collection, batch, session)
+    repository.insert_many(Collection.PROJECT, projects, session)
+    return projects[-1]['_id'] if projects else None
+
+
+def _copy_project(documents, remap_ids: bool, title: str, workspace_id: ObjectId):
+    ids = _IdMap()
+    for collection, document in documents:
+        if remap_ids:
+            document = _remap(collection, document, ids)
+        if collection == Collection.PROJECT:
+            if title is not None:
+                document['title'] = title
+            if workspace_id is not None:
+                document['workspaceId'] = workspace_id
+        yield collection, document
+
+
+def duplicate_project(repository: Repository,
+                      project_id: ObjectId,
+                      title: str = None,
+                      workspace_id: ObjectId = None,
+                      batch_size: int = 500,
+                      use_transaction: bool = False) -> ObjectId:
+    """
+    Copies a project with its models, diagrams and model representations.
+    Documents are streamed from the database, given new ids and written back in batches,
+    so the project is never held in memory at once.
+    :param repository: repository to copy in
+    :param project_id: id of the project to copy
+    :param title: Optional! title of the copy, defaults to the title of the original
+    :param workspace_id: Optional! workspace to place the copy in, defaults to the workspace of the original
+    :param batch_size: number of documents read and written per round trip
+    :param use_transaction: if True, copies in a transaction, so nothing is written if the copy fails.
+        Requires a replica set when used with MongoDB. Without a transaction, the project document is written last,
+        so an interrupted copy leaves no project referencing the partial contents
+    :return: id of the copy
+    """
+    if use_transaction:
+        with repository.transaction() as session:
+            return _duplicate_project(repository, project_id, title, workspace_id, batch_size, session)
+    return _duplicate_project(repository, project_id, title, workspace_id, batch_size, None)
+
+
+def _duplicate_project(repository: Repository, project_id: ObjectId, title: str, workspace_id: ObjectId,
+                       batch_size: int, session) -> ObjectId:
+    documents = _project_documents(repository, project_id, batch_size, session)
+    return _write_batches(repository, _copy_project(documents, True, title, workspace_id), batch_size, session)
+
+
+def export_project(repository: Repository,
+                   project_id: ObjectId,
+                   file,
+                   compress: bool = True,
+                   batch_size: int = 500) -> dict:
+    """
+    Writes a project with its models, diagrams and model representations to a single BSON archive.
+
+    The archive is a header document followed by one document per record, `{'c': collection, 'd': document}`,
+    optionally gzip compressed. Documents are streamed, so the project is never held in memory at once.
+
+    :param repository: repository to export from
+    :param project_id: id of the project
+    :param file: path or binary file object to write to
+    :param compress: if True, compresses the archive with gzip
+    :param batch_size: number of documents read per round trip
+    :return: number of exported documents per collection
+    """
+    counts = {}
+    with _ArchiveFile(file, 'wb', compress) as f:
+        f.write(bson.encode({
+            'format': ARCHIVE_FORMAT,
+            'version': ARCHIVE_VERSION,
+            'projectId': project_id,
+            'exported': datetime.now(timezone.utc)
+        }))
+        for collection, document in _project_documents(repository, project_id, batch_size):
+            f.write(bson.encode({'c': collection.value, 'd': document}))
+            counts[collection] = counts.get(collection, 0) + 1
+    return counts
+
+
+def read_archive(file):
+    """
+    Streams the records of an archive written by `export_project`.
+    :param file: path or binary file object to read from
+    :return: generator of (Collection, document)
+    """
+    with _ArchiveFile(file, 'rb') as f:
+        records = bson.decode_file_iter(f)
+        header = next(records, None)
+        if header is None or header.get('format') != ARCHIVE_FORMAT:
+            raise ValueError('Not a project archive')
+        if header.get('version') != ARCHIVE_VERSION:
+            raise ValueError(f'Unsupported project archive version: {header.get("version")}')
+        for record in records:
+            yield Collection(record['c']), record['d']
+
+
+def import_project(repository: Repository,
+                   file,
+                   remap_ids: bool = True,
+                   title: str = None,
+                   workspace_id: ObjectId = None,
+                   batch_size: int = 500,
+                   use_transaction: bool = False) -> ObjectId:
+    """
+    Loads a project archive written by `export_project`, streaming it in batches.
+    :param repository: repository to import into
+    :param file: path or binary file object to read from
+    :param remap_ids: if True, gives all documents new ids, so an archive can be imported next to the original.
+        If False, the original ids are kept, which restores a deleted project
+    :param title: Optional! title of the imported project, defaults to the archived title
+    :param workspace_id: Optional! workspace to place the project in, defaults to the archived workspace
+    :param batch_size: number of documents written per round trip
+    :param use_transaction: if True, imports in a transaction, so nothing is written if the import fails.
+        Requires a replica set when used with MongoDB. Without a transaction, the project document is written last
+    :return: id of the imported project
+    """
+    documents = _copy_project(read_archive(file), remap_ids, title, workspace_id)
+    if use_transaction:
+        with repository.transaction() as session:
+            return _write_batches(repository, documents, batch_size, session)
+    return _write_batches(repository, documents, batch_size)
+
+
+class _ArchiveFile:
+    """
+    Opens a path, or wraps an open file object, detecting gzip compression when reading.
+    """
+
+    def __init__(self, file, mode: str, compress: bool = False):
+        self._owned = isinstance(file, (str, bytes)) or hasattr(file, '__fspath__')
+        self._raw = open(file, mode) if self._owned else file
+        if mode == 'rb':
+            compress = self._peek(2) == _GZIP_MAGIC
+        self._file = gzip.GzipFile(fileobj=self._raw, mode=mode) if compress else self._raw
+
+    def _peek(self, size: int) -> bytes:
+        position = self._raw.tell()
+        data = self._raw.read(size)
+        self._raw.seek(position)
+        return data
+
+    def __enter__(self):
+        return self._file
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._file is not self._raw:
+            self._file.close()
+        if self._owned:
+            self._raw.close()
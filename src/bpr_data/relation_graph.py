@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+from collections import deque
+from typing import Type
+
+from bson.objectid import ObjectId
+
+from .models.model import HistoryBaseAction, Relation
+from .models.mongo_document_base import SerializableObject
+from .repository import Collection, Repository, T
+
+
+def _object_id(value):
+    # Ids of actions received as JSON are strings
+    return ObjectId(value) if isinstance(value, str) else value
+
+
+class RelationGraph:
+    """
+    In-memory adjacency index over the relations between the models of a project.
+
+    Keeps forward edges (model -> relation targets) and reverse edges (target -> models relating to it),
+    so traversals in either direction need no database round trips.
+    Build it with `RelationGraph.build` and keep it current by passing relation actions to `apply`.
+    """
+
+    def __init__(self, project_id: ObjectId):
+        self.project_id = project_id
+        self._forward = {}  # model id -> {relation id: (target id, relation type)}
+        self._reverse = {}  # target id -> {relation id: source model id}
+
+    @staticmethod
+    def build(repository: Repository, project_id: ObjectId) -> RelationGraph:
+        """
+        Builds the graph of a project with a single query.
+        :param repository: repository to load the models from
+        :param project_id: id of the project
+        :return: the graph
+        """
+        graph = RelationGraph(project_id)
+        models = repository.aggregate(Collection.MODEL, [
+            {'$match': {'projectId': project_id}},
+            {'$project': {'relations._id': 1, 'relations.target': 1, 'relations.type': 1}}
+        ])
+        for model in models:
+            graph.add_model(model['_id'])
+            for relation in model.get('relations') or []:
+                graph.add_relation(model['_id'], relation)
+        return graph
+
+    def __contains__(self, model_id: ObjectId) -> bool:
+        return model_id in self._forward
+
+    def __len__(self) -> int:
+        return len(self._forward)
+
+    def add_model(self, model_id: ObjectId) -> None:
+        self._forward.setdefault(model_id, {})
+
+    def remove_model(self, model_id: ObjectId) -> None:
+        """
+        Removes a model with its outgoing relations.
+        Relations from other models targeting it are kept, as they are still stored on those models.
+        """
+        for relation_id in list(self._forward.get(model_id, {})):
+            self.remove_relation(model_id, relation_id)
+        self._forward.pop(model_id, None)
+
+    def add_relation(self, model_id: ObjectId, relation: Relation | dict) -> None:
+        """
+        :param model_id: id of the model the relation is stored on
+        :param relation: the relation
+        """
+        if isinstance(relation, SerializableObject):
+            relation = relation.as_dict()
+        relation_id = _object_id(relation.get('_id'))
+        target = _object_id(relation['target'])
+        self._forward.setdefault(model_id, {})[relation_id] = (target, relation.get('type'))
+        self._reverse.setdefault(target, {})[relation_id] = model_id
+
+    def remove_relation(self, model_id: ObjectId, relation_id: ObjectId | str) -> None:
+        relation_id = _object_id(relation_id)
+        edge = self._forward.get(model_id, {}).pop(relation_id, None)
+        if edge is None:
+            return
+        sources = self._reverse.get(edge[0], {})
+        sources.pop(relation_id, None)
+        if not sources:
+            self._reverse.pop(edge[0], None)
+
+    def apply(self, model_id: ObjectId, action: HistoryBaseAction | dict) -> None:
+        """
+        Updates the graph from a history action on a model.
+        Actions that do not concern relations are ignored.
+        :param model_id: id of the model the action was performed on
+        :param action: CreateRelationAction, UpdateRelationAction or RemoveRelationAction, as object or dict
+        """
+        if isinstance(action, SerializableObject):
+            action = action.as_dict()
+        kind = action.get('action')
+        if kind == 'createRelation':
+            self.add_relation(model_id, action['item'])
+        elif kind == 'updateRelation':
+            old_item = action['oldItem']
+            if isinstance(old_item, SerializableObject):
+                old_item = old_item.as_dict()
+            self.remove_relation(model_id, old_item['_id'])
+            self.add_relation(model_id, action['newItem'])
+        elif kind == 'removeRelation':
+            self.remove_relation(model_id, action['itemId'])
+
+    def targets(self, model_id: ObjectId, relation_types: list = None) -> list:
+        """
+        :return: ids of the models that `model_id` has relations to
+        """
+        return list(dict.fromkeys(target for target, kind in self._forward.get(model_id, {}).values()
+                                  if relation_types is None or kind in relation_types))
+
+    def sources(self, model_id: ObjectId, relation_types: list = None) -> list:
+        """
+        :return: ids of the models that have relations to `model_id`
+        """
+        return list(dict.fromkeys(source for relation_id, source in self._reverse.get(model_id, {}).items()
+                                  if relation_types is None or self._forward[source][relation_id][1] in relation_types))
+
+    def traverse(self, model_id: ObjectId, reverse: bool = False, max_depth: int = None,
+                 relation_types: list = None) -> dict:
+        """
+        Breadth first traversal from a model.
+        :param model_id: id of the model to start from
+        :param reverse: if True, follows relations backwards, to the models depending on `model_id`
+        :param max_depth: Optional! maximum number of hops
+        :param relation_types: Optional! only follow relations of these types
+        :return: dict of reachable model ids to their distance from `model_id`, in traversal order
+        """
+        neighbours = self.sources if reverse else self.targets
+        depths = {model_id: 0}
+        queue = deque([model_id])
+        while queue:
+            current = queue.popleft()
+            if max_depth is not None and depths[current] >= max_depth:
+                continue
+            for neighbour in neighbours(current, relation_types):
+                if neighbour not in depths:
+                    depths[neighbour] = depths[current] + 1
+                    queue.append(neighbour)
+        del depths[model_id]
+        return depths
+
+    def dependents(self, model_id: ObjectId, max_depth: int = None, relation_types: list = None) -> dict:
+        """
+        Impact analysis: all models that directly or indirectly relate to `model_id`.
+        """
+        return self.traverse(model_id, True, max_depth, relation_types)
+
+    def inheritance_chain(self, model_id: ObjectId, relation_types: list = None) -> list:
+        """
+        Follows the first inheritance relation of each model until a model without one is reached.
+        :return: ids of the ancestors of `model_id`, nearest first
+        """
+        relation_types = relation_types or ['inheritance']
+        chain = []
+        current = model_id
+        while True:
+            parents = self.targets(current, relation_types)
+            if not parents or parents[0] == model_id or parents[0] in chain:
+                return chain
+            current = parents[0]
+            chain.append(current)
+
+
+def find_related_models(repository: Repository,
+                        model_id: ObjectId,
+                        reverse: bool = False,
+                        max_depth: int = None,
+                        return_type: Type[T] = None) -> list:
+    """
+    Finds the models reachable from a model through relations, server-side in a single query.
+    Unlike `RelationGraph.traverse`, relation types cannot be filtered on, since relations are not documents.
+    :param repository: repository to query
+    :param model_id: id of the model to start from
+    :param reverse: if True, follows relations backwards, to the models depending on `model_id`
+    :param max_depth: Optional! maximum number of hops, 1 only returns directly related models
+    :param return_type: Optional! Subclass of SerializableObject to cast result to, the depth is then discarded
+    :return: list of models as dicts with a `depth` field, nearest first
+    """
+    if max_depth is not None and max_depth < 1:
+        return []
+    if reverse:
+        start_with, connect_from_field, connect_to_field = '$_id', '_id', 'relations.target'
+    else:
+        start_with, connect_from_field, connect_to_field = '$relations.target', 'relations.target', '_id'
+
+    results = repository.graph_lookup(Collection.MODEL,
+                                      start_with,
+                                      connect_from_field,
+                                      connect_to_field,
+                                      'related',
+                                      max_depth=max_depth - 1 if max_depth is not None else None,
+                                      depth_field='depth',
+                                      _id=model_id)
+    if not results:
+        return []
+    start = results[0]
+    related = [x for x in start['related'] if x['_id'] != model_id]
+    related.sort(key=lambda x: x['depth'])
+    for model in related:
+        model['depth'] += 1
+    if return_type is not None:
+        return return_type.from_dict_list(related)
+    return related
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+from contextlib import contextmanager
 from enum import Enum
 from typing import TypeVar, Type
 
@@ -24,6 +25,19 @@ class Collection(Enum):
 
 T = TypeVar('T', bound=SerializableObject)
 
+# Fields queried by the servers, indexed by `Repository.create_indexes`
+# Tuples are compound indexes
+INDEXES = {
+    Collection.WORKSPACE: ['users.userId'],
+    Collection.USER: ['firebaseId', 'email'],
+    Collection.TEAM: ['workspaceId', 'users.userId'],
+    Collection.INVITATION: ['workspaceId', 'inviteeEmailAddress'],
+    Collection.PROJECT: ['workspaceId', 'users.userId', 'teams.teamId'],
+    Collection.DIAGRAM: [('projectId', 'path')],
+    Collection.MODEL: [('projectId', 'path'), 'relations.target'],
+    Collection.MODEL_REPRESENTATION: ['diagramId', 'modelId'],
+}
+
 
 class Repository:
     __instance = None
@@ -36,12 +50,39 @@ class Repository:
     _default_db = ""
 
     @staticmethod
-    def get_instance(protocol, user, pw, host, default_db) -> Repository:
+    def get_instance(protocol, user, pw, host, default_db, client=None) -> Repository:
         if Repository.__instance is None:
-            Repository(protocol, user, pw, host, default_db)
+            Repository(protocol, user, pw, host, default_db, client)
         return Repository.__instance
 
-    def __init__(self, protocol, user, pw, host, default_db):
+    @staticmethod
+    def get_in_memory_instance(default_db: str = 'test') -> Repository:
+        """
+        Returns the instance backed by a fresh in-memory storage engine instead of MongoDB.
+        Any existing instance is discarded.
+        Intended for tests and benchmarks, do not use in code
+        :param default_db: name of the in-memory database
+        :return: the new instance
+        """
+        from .memory_backend import MemoryClient
+
+        Repository.reset_instance()
+        repository = Repository.get_instance('', '', '', '', default_db, MemoryClient(default_db))
+        repository.create_indexes()
+        return repository
+
+    @staticmethod
+    def reset_instance() -> None:
+        """
+        Discards the current instance so the next call to `get_instance` creates a new one.
+        """
+        Repository.__instance = None
+
+    def __init__(self, protocol, user, pw, host, default_db, client=None):
+        """
+        :param client: Optional! storage backend exposing the pymongo `MongoClient` interface, such as
+            `memory_backend.MemoryClient`. A `MongoClient` is created from the connection parameters if omitted
+        """
         if Repository.__instance is not None:
             raise Exception("Singleton class! Use get_instance()")
         else:
@@ -51,6 +92,20 @@ class Repository:
             Repository._pw = pw
             Repository._host = host
             Repository._default_db = default_db
+            if client is not None:
+                self.__client = client
+
+    def create_indexes(self, indexes: dict = None) -> None:
+        """
+        Creates secondary indexes on the given fields. Existing indexes are left untouched.
+        :param indexes: Optional! mapping of Collection to list of field names or tuples of field names.
+            Defaults to `INDEXES`
+        :return: None
+        """
+        for collection, fields in (indexes or INDEXES).items():
+            for field in fields:
+                keys = field if isinstance(field, str) else [(x, mongo.ASCENDING) for x in field]
+                self.__get_collection(collection).create_index(keys)
 
     def insert(self,
                collection: Collection,
@@ -77,6 +132,43 @@ class Repository:
                 return return_type.from_dict(result)
             return result
 
+    def insert_many(self,
+                    collection: Collection,
+                    items: list,
+                    session=None) -> list:
+        """
+        Inserts documents into the given collection in a single operation.
+        Unlike `insert`, the _id field is kept, so documents can be copied with their ids.
+        Documents without an _id field are given one by MongoDB.
+        :param collection: Collection to insert into
+        :param items: list of dicts or instances of SerializableObject to insert
+        :param session: Optional! session from `transaction` to run the operation in
+        :return: ids of the inserted documents
+        """
+        if len(items) == 0:
+            return []
+        documents = [x.as_dict() if isinstance(x, SerializableObject) else x for x in items]
+        result = self.__get_collection(collection).insert_many(documents, session=session)
+        return result.inserted_ids
+
+    def iterate(self,
+                collection: Collection,
+                query: dict = None,
+                batch_size: int = 500,
+                session=None):
+        """
+        Streams the documents matching the query, fetching `batch_size` documents per round trip,
+        so large result sets are never held in memory at once.
+        :param collection: collection to search
+        :param query: Optional! filter selecting the documents
+        :param batch_size: number of documents fetched per round trip
+        :param session: Optional! session from `transaction` to run the operation in
+        :return: generator of documents as dicts
+        """
+        cursor = self.__get_collection(collection).find(query or {}, session=session).batch_size(batch_size)
+        for document in cursor:
+            yield document
+
     def find(self,
              collection: Collection,
              return_type: Type[T] = None,
@@ -142,6 +234,46 @@ class Repository:
         delete_result = self.__get_collection(collection).delete_one(__kwargs)
         return delete_result.deleted_count > 0
 
+    def delete_many(self,
+                    collection: Collection,
+                    query: dict,
+                    session=None) -> int:
+        """
+        Delete all items matching the query in a single server-side operation.
+        :param collection: collection to delete from
+        :param query: filter selecting the documents to delete, ex: {'_id': {'$in': ids}}
+        :param session: Optional! session from `transaction` to run the operation in
+        :return: number of deleted documents
+        """
+        delete_result = self.__get_collection(collection).delete_many(query, session=session)
+        return delete_result.deleted_count
+
+    def distinct(self,
+                 collection: Collection,
+                 field_name: str,
+                 query: dict = None,
+                 session=None) -> list:
+        """
+        Returns the distinct values of a field among the documents matching the query.
+        :param collection: collection to query
+        :param field_name: field to collect values of, ex: '_id'
+        :param query: Optional! filter selecting the documents
+        :param session: Optional! session from `transaction` to run the operation in
+        :return: list of distinct values
+        """
+        return self.__get_collection(collection).distinct(field_name, query or {}, session=session)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Context manager running a transaction. Pass the yielded session to the operations that should be part of it.
+        The transaction is committed when the block exits and aborted if it raises.
+        Requires a replica set when used with MongoDB.
+        """
+        with self.__get_client().start_session() as session:
+            with session.start_transaction():
+                yield session
+
     def __purge(self, collection: Collection):
         """
         Utility function that deletes all items in a given collection
@@ -176,6 +308,22 @@ class Repository:
             return return_type.from_dict(result)
         return result
 
+    def update_many(self,
+                    collection: Collection,
+                    query: dict,
+                    update,
+                    session=None) -> int:
+        """
+        Updates all documents matching the query in a single server-side operation.
+        :param collection: collection to query
+        :param query: filter selecting the documents to update
+        :param update: update document, ex: {'$set': {'path': '/'}}, or aggregation pipeline
+        :param session: Optional! session from `transaction` to run the operation in
+        :return: number of modified documents
+        """
+        update_result = self.__get_collection(collection).update_many(query, update, session=session)
+        return update_result.modified_count
+
     def update_list_item(self,
                          collection: Collection,
                          document_id: ObjectId,
@@ -330,6 +478,62 @@ class Repository:
             return return_type.from_dict_list(result)
         return result
 
+    def graph_lookup(self,
+                     collection: Collection,
+                     start_with: str,
+                     connect_from_field: str,
+                     connect_to_field: str,
+                     to_field: str,
+                     max_depth: int = None,
+                     depth_field: str = None,
+                     restrict_search_with_match: dict = None,
+                     return_type: Type[T] = None,
+                     **match_args) -> list:
+        """
+        Returns results from `collection` with the documents reachable by recursively following
+        `connect_from_field` to `connect_to_field` within the same collection as sub-documents.
+
+        The search runs server-side in a single `$graphLookup` aggregation.
+
+        A filter step will be added to the beginning of the pipeline if filtering arguments are added to `match_args`.
+
+        :param collection: collection to search
+        :param start_with: expression of the values to start the search from. ex: '$relations.target'
+        :param connect_from_field: field whose values are followed to the next documents. ex: 'relations.target'
+        :param connect_to_field: field matched against the followed values. ex: '_id'
+        :param to_field: field containing the reachable documents
+        :param max_depth: Optional! maximum recursion depth, 0 only returns the documents matching `start_with`
+        :param depth_field: Optional! field on each reachable document containing its recursion depth
+        :param restrict_search_with_match: Optional! additional query the reachable documents must match
+        :param match_args: arguments to filter the starting documents by
+        :param return_type: Optional! Subclass of SerializableObject to cast result to
+        :return: list of resulting documents
+        """
+        if 'id' in match_args:
+            if match_args['id'] is not None:
+                match_args['_id'] = ObjectId(match_args['id'])
+            del match_args['id']
+
+        graph_lookup = {
+            'from': collection.value,
+            'startWith': start_with,
+            'connectFromField': connect_from_field,
+            'connectToField': connect_to_field,
+            'as': to_field
+        }
+        if max_depth is not None:
+            graph_lookup['maxDepth'] = max_depth
+        if depth_field is not None:
+            graph_lookup['depthField'] = depth_field
+        if restrict_search_with_match:
+            graph_lookup['restrictSearchWithMatch'] = restrict_search_with_match
+
+        pipeline = [{'$graphLookup': graph_lookup}]
+        if match_args:
+            pipeline.insert(0, {'$match': match_args})
+
+        return self.aggregate(collection, pipeline, return_type)
+
     def aggregate(self,
                   collection: Collection,
                   pipeline: list,
@@ -369,9 +573,12 @@ class Repository:
             raise TypeError("_id field must be of type ObjectId")
         return kwargs
 
-    def __get_collection(self, collection: Collection):
+    def __get_client(self):
         if self.__client is None:
             self.__client = mongo.MongoClient(
                 f'{self._protocol}://{self._user}:{self._pw}@{self._host}/{self._default_db}?retryWrites=true&w=majority')
-        db = self.__client.get_default_database()
+        return self.__client
+
+    def __get_collection(self, collection: Collection):
+        db = self.__get_client().get_default_database()
         return db[collection.value]
@@ -0,0 +1,308 @@
+from __future__ import annotations
+
+import math
+from typing import Type
+
+from bson.objectid import ObjectId
+
+from .models.model import ModelRepresentation
+from .models.mongo_document_base import SerializableObject
+from .repository import Collection, Repository, T
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Boxes covering more cells than this are kept out of the grid and checked on every query,
+# so a single huge box cannot blow up the number of cells
+_MAX_CELLS_PER_BOX = 64
+
+
+class SpatialIndex:
+    """
+    Uniform grid index over the bounding boxes of the model representations in a diagram.
+
+    Supports viewport range queries, point hit testing and overlap detection.
+    Boxes are closed, so boxes that touch count as intersecting.
+    If NumPy is installed, the bulk methods (`bulk_load`, `query_many`, `hit_test_many`, `overlapping_pairs`)
+    are vectorized. Otherwise they fall back to the grid.
+    Boxes much larger than a cell are not put in the grid, but kept in a list checked by every query.
+    """
+
+    def __init__(self, cell_size: float = 256.0):
+        """
+        :param cell_size: width and height of a grid cell, ideally close to the typical representation size
+        """
+        if cell_size <= 0:
+            raise ValueError('cell_size must be positive')
+        self.cell_size = cell_size
+        self._boxes = {}  # id -> (x0, y0, x1, y1)
+        self._cells = {}  # (column, row) -> set of ids
+        self._large = set()  # ids of boxes covering more than _MAX_CELLS_PER_BOX cells
+        self._sequence = {}  # id -> insertion counter, results are returned in insertion order
+        self._counter = 0
+        self._arrays = None  # (ids, bounds) for vectorized queries, rebuilt when stale
+
+    @staticmethod
+    def build(repository: Repository, diagram_id: ObjectId, cell_size: float = 256.0) -> SpatialIndex:
+        """
+        Builds the index of a diagram with a single query that only fetches the geometry.
+        :param repository: repository to load the representations from
+        :param diagram_id: id of the diagram
+        :param cell_size: see `__init__`
+        :return: the index
+        """
+        index = SpatialIndex(cell_size)
+        representations = repository.aggregate(Collection.MODEL_REPRESENTATION, [
+            {'$match': {'diagramId': diagram_id}},
+            {'$project': {'x': 1, 'y': 1, 'w': 1, 'h': 1}}
+        ])
+        index.bulk_load(representations)
+        return index
+
+    def __len__(self) -> int:
+        return len(self._boxes)
+
+    def __contains__(self, representation_id) -> bool:
+        return representation_id in self._boxes
+
+    # UPDATES
+
+    def insert(self, representation_id, x: float, y: float, w: float, h: float) -> None:
+        """
+        Inserts a box, replacing any box already stored for the id.
+        """
+        if representation_id in self._boxes:
+            self.remove(representation_id)
+        box = (min(x, x + w), min(y, y + h), max(x, x + w), max(y, y + h))
+        self._boxes[representation_id] = box
+        self._counter += 1
+        self._sequence[representation_id] = self._counter
+        self._add_to_grid(representation_id, self._cell_range(box))
+        self._arrays = None
+
+    def update(self, representation: ModelRepresentation | dict) -> None:
+        """
+        Inserts or moves a representation after a geometry update.
+        :param representation: ModelRepresentation or dict with `_id`, `x`, `y`, `w` and `h`
+        """
+        if isinstance(representation, SerializableObject):
+            representation = representation.as_dict()
+        self.insert(representation['_id'], representation['x'], representation['y'],
+                    representation['w'], representation['h'])
+
+    def remove(self, representation_id) -> None:
+        box = self._boxes.pop(representation_id, None)
+        if box is None:
+            return
+        del self._sequence[representation_id]
+        if representation_id in self._large:
+            self._large.discard(representation_id)
+        else:
+            for cell in self._cells_of(box):
+                ids = self._cells.get(cell)
+                if ids is not None:
+                    ids.discard(representation_id)
+                    if not ids:
+                        del self._cells[cell]
+        self._arrays = None
+
+    def bulk_load(self, representations: list) -> None:
+        """
+        Inserts many representations at once.
+        :param representations: list of ModelRepresentation or dicts with `_id`, `x`, `y`, `w` and `h`
+        """
+        representations = [x.as_dict() if isinstance(x, SerializableObject) else x for x in representations]
+        if np is None or not representations:
+            for representation in representations:
+                self.update(representation)
+            return
+
+        # Only the last box of an id given more than once is kept, like with repeated `update` calls
+        latest = {}
+        for representation in representations:
+            latest.pop(representation['_id'], None)
+            latest[representation['_id']] = representation
+        representations = list(latest.values())
+        for representation in representations:
+            self.remove(representation['_id'])
+        ids = [x['_id'] for x in representations]
+        geometry = np.array([(x['x'], x['y'], x['w'], x['h']) for x in representations], dtype=float)
+        corners = geometry[:, :2] + geometry[:, 2:]
+        bounds = np.hstack([np.minimum(geometry[:, :2], corners), np.maximum(geometry[:, :2], corners)])
+        cells = np.floor(bounds / self.cell_size).astype(np.int64)
+
+        for representation_id, box, cell_range in zip(ids, map(tuple, bounds.tolist()), cells.tolist()):
+            self._boxes[representation_id] = box
+            self._counter += 1
+            self._sequence[representation_id] = self._counter
+            self._add_to_grid(representation_id, cell_range)
+        self._arrays = None
+
+    # QUERIES
+
+    def query(self, x: float, y: float, w: float, h: float) -> list:
+        """
+        :return: ids of the representations intersecting the viewport
+        """
+        viewport = (min(x, x + w), min(y, y + h), max(x, x + w), max(y, y + h))
+        found = set()
+        for representation_id in self._candidates(viewport):
+            if representation_id not in found and _intersects(self._boxes[representation_id], viewport):
+                found.add(representation_id)
+        return self._ordered(found)
+
+    def hit_test(self, x: float, y: float) -> list:
+        """
+        :return: ids of the representations containing the point
+        """
+        cell = (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+        candidates = self._cells.get(cell, set()) | self._large
+        found = {i for i in candidates if _intersects(self._boxes[i], (x, y, x, y))}
+        return self._ordered(found)
+
+    def overlaps(self, representation_id) -> list:
+        """
+        :return: ids of the other representations overlapping the given one
+        """
+        x0, y0, x1, y1 = self._boxes[representation_id]
+        return [i for i in self.query(x0, y0, x1 - x0, y1 - y0) if i != representation_id]
+
+    def query_many(self, viewports: list) -> list:
+        """
+        Vectorized `query` for many viewports.
+        :param viewports: list of (x, y, w, h) tuples
+        :return: list with a list of ids for each viewport
+        """
+        if np is None or not self._boxes:
+            return [self.query(*x) for x in viewports]
+        ids, bounds = self._as_arrays()
+        results = []
+        for x, y, w, h in viewports:
+            mask = (bounds[:, 0] <= max(x, x + w)) & (bounds[:, 2] >= min(x, x + w)) \
+                   & (bounds[:, 1] <= max(y, y + h)) & (bounds[:, 3] >= min(y, y + h))
+            results.append([ids[i] for i in np.flatnonzero(mask)])
+        return results
+
+    def hit_test_many(self, points: list) -> list:
+        """
+        Vectorized `hit_test` for many points.
+        :param points: list of (x, y) tuples
+        :return: list with a list of ids for each point
+        """
+        return self.query_many([(x, y, 0, 0) for x, y in points])
+
+    def overlapping_pairs(self) -> list:
+        """
+        :return: list of (id, id) tuples of all overlapping representations, each pair reported once
+        """
+        if np is None:
+            pairs = []
+            for representation_id in self._boxes:
+                position = self._sequence[representation_id]
+                pairs.extend((representation_id, x) for x in self.overlaps(representation_id)
+                             if self._sequence[x] > position)
+            return pairs
+
+        ids, bounds = self._as_arrays()
+        # Sweep along x: only boxes starting before the current box ends can overlap it
+        order = np.argsort(bounds[:, 0], kind='stable')
+        sorted_bounds = bounds[order]
+        ends = np.searchsorted(sorted_bounds[:, 0], sorted_bounds[:, 2], side='right')
+        pairs = []
+        for i in range(len(order)):
+            candidates = sorted_bounds[i + 1:ends[i]]
+            mask = (candidates[:, 1] <= sorted_bounds[i, 3]) & (candidates[:, 3] >= sorted_bounds[i, 1])
+            for j in np.flatnonzero(mask) + i + 1:
+                a, b = sorted((int(order[i]), int(order[j])))
+                pairs.append((a, b))
+        pairs.sort()
+        return [(ids[a], ids[b]) for a, b in pairs]
+
+    # INTERNALS
+
+    def _cell_range(self, box: tuple) -> tuple:
+        return (math.floor(box[0] / self.cell_size), math.floor(box[1] / self.cell_size),
+                math.floor(box[2] / self.cell_size), math.floor(box[3] / self.cell_size))
+
+    def _cells_of(self, box: tuple):
+        c0, r0, c1, r1 = self._cell_range(box)
+        for column in range(c0, c1 + 1):
+            for row in range(r0, r1 + 1):
+                yield column, row
+
+    def _add_to_grid(self, representation_id, cell_range: tuple) -> None:
+        c0, r0, c1, r1 = cell_range
+        if (c1 - c0 + 1) * (r1 - r0 + 1) > _MAX_CELLS_PER_BOX:
+            self._large.add(representation_id)
+            return
+        for column in range(c0, c1 + 1):
+            for row in range(r0, r1 + 1):
+                self._cells.setdefault((column, row), set()).add(representation_id)
+
+    def _candidates(self, box: tuple):
+        """
+        Yields the ids stored in the cells overlapping `box` and the large boxes, possibly more than once.
+        Viewports covering more cells than are occupied scan the occupied cells instead.
+        """
+        yield from self._large
+        c0, r0, c1, r1 = self._cell_range(box)
+        if (c1 - c0 + 1) * (r1 - r0 + 1) > len(self._cells):
+            for (column, row), ids in self._cells.items():
+                if c0 <= column <= c1 and r0 <= row <= r1:
+                    yield from ids
+            return
+        for column in range(c0, c1 + 1):
+            for row in range(r0, r1 + 1):
+                yield from self._cells.get((column, row), ())
+
+    def _as_arrays(self):
+        if self._arrays is None:
+            ids = list(self._boxes.keys())
+            self._arrays = ids, np.array(list(self._boxes.values()), dtype=float).reshape(-1, 4)
+        return self._arrays
+
+    def _ordered(self, ids: set) -> list:
+        return sorted(ids, key=self._sequence.get)
+
+
+def _intersects(a: tuple, b: tuple) -> bool:
+    return a[0] <= b[2] and a[2] >= b[0] and a[1] <= b[3] and a[3] >= b[1]
+
+
+def find_in_viewport(repository: Repository,
+                     diagram_id: ObjectId,
+                     x: float,
+                     y: float,
+                     w: float,
+                     h: float,
+                     return_type: Type[T] = None) -> list:
+    """
+    Finds the model representations of a diagram intersecting a viewport, server-side.
+    Use this to stream the visible region of a diagram without building a `SpatialIndex`.
+    :param repository: repository to query
+    :param diagram_id: id of the diagram
+    :param x: left edge of the viewport
+    :param y: top edge of the viewport
+    :param w: width of the viewport
+    :param h: height of the viewport
+    :param return_type: Optional! Subclass of SerializableObject to cast result to
+    :return: list of representations
+    """
+    x0, x1 = min(x, x + w), max(x, x + w)
+    y0, y1 = min(y, y + h), max(y, y + h)
+    # Representations may have a negative width or height, so their bounds are normalised like in `SpatialIndex`
+    right = {'$add': ['$x', '$w']}
+    bottom = {'$add': ['$y', '$h']}
+    return repository.aggregate(Collection.MODEL_REPRESENTATION, [
+        {'$match': {
+            'diagramId': diagram_id,
+            '$expr': {'$and': [
+                {'$lte': [{'$min': ['$x', right]}, x1]},
+                {'$gte': [{'$max': ['$x', right]}, x0]},
+                {'$lte': [{'$min': ['$y', bottom]}, y1]},
+                {'$gte': [{'$max': ['$y', bottom]}, y0]}
+            ]}
+        }}
+    ], return_type)
@@ -0,0 +1,114 @@
+import pytest
+from bson.objectid import ObjectId
+
+from bpr_data.cascade import cascade_delete
+from bpr_data.repository import Collection, Repository
+
+COLLECTIONS = (Collection.WORKSPACE, Collection.USER, Collection.TEAM, Collection.INVITATION, Collection.PROJECT,
+               Collection.DIAGRAM, Collection.MODEL, Collection.MODEL_REPRESENTATION)
+
+
+@pytest.fixture
+def repository():
+    Repository.reset_instance()
+    repository = Repository.get_in_memory_instance()
+    yield repository
+    Repository.reset_instance()
+
+
+@pytest.fixture
+def tree(repository):
+    """
+    Two workspaces, each with a team, an invitation and two projects.
+    Each project has two diagrams and three models, with a representation of every model on every diagram.
+    """
+    ids = {'workspaces': [], 'projects': [], 'diagrams': [], 'models': [], 'user': ObjectId()}
+    repository.insert_many(Collection.USER, [{'_id': ids['user'], 'name': 'Ann'}])
+    for _ in range(2):
+        workspace_id, team_id = ObjectId(), ObjectId()
+        ids['workspaces'].append(workspace_id)
+        repository.insert_many(Collection.WORKSPACE, [{'_id': workspace_id, 'users': [{'userId': ids['user']}]}])
+        repository.insert_many(Collection.TEAM, [
+            {'_id': team_id, 'workspaceId': workspace_id, 'users': [{'userId': ids['user']}]}
+        ])
+        repository.insert_many(Collection.INVITATION, [{'_id': ObjectId(), 'workspaceId': workspace_id}])
+        for _ in range(2):
+            project_id = ObjectId()
+            ids['projects'].append(project_id)
+            repository.insert_many(Collection.PROJECT, [{
+                '_id': project_id, 'workspaceId': workspace_id,
+                'users': [{'userId': ids['user']}], 'teams': [{'teamId': team_id}]
+            }])
+            model_ids = [ObjectId() for _ in range(3)]
+            ids['models'].extend(model_ids)
+            repository.insert_many(Collection.MODEL, [
+                {'_id': x, 'projectId': project_id, 'relations': [{'_id': ObjectId(), 'target': y}
+                                                                  for y in model_ids if y != x]}
+                for x in model_ids
+            ])
+            for _ in range(2):
+                diagram_id = ObjectId()
+                ids['diagrams'].append(diagram_id)
+                representations = [{'_id': ObjectId(), 'diagramId': diagram_id, 'modelId': x} for x in model_ids]
+                repository.insert_many(Collection.MODEL_REPRESENTATION, representations)
+                repository.insert_many(Collection.DIAGRAM, [{
+                    '_id': diagram_id, 'projectId': project_id, 'models': [x['_id'] for x in representations]
+                }])
+    return ids
+
+
+def _counts(repository: Repository) -> dict:
+    return {x: len(list(repository.iterate(x))) for x in COLLECTIONS}
+
+
+@pytest.mark.parametrize('batch_size', [1000, 1])
+def test_delete_workspace(repository, tree, batch_size):
+    counts = cascade_delete(repository, Collection.WORKSPACE, [tree['workspaces'][0]], batch_size=batch_size)
+    assert counts == {Collection.WORKSPACE: 1, Collection.PROJECT: 2, Collection.TEAM: 1, Collection.INVITATION: 1,
+                      Collection.DIAGRAM: 4, Collection.MODEL: 6, Collection.MODEL_REPRESENTATION: 12}
+    assert _counts(repository) == {Collection.WORKSPACE: 1, Collection.USER: 1, Collection.TEAM: 1,
+                                   Collection.INVITATION: 1, Collection.PROJECT: 2, Collection.DIAGRAM: 4,
+                                   Collection.MODEL: 6, Collection.MODEL_REPRESENTATION: 12}
+
+
+def test_representations_reached_twice_are_counted_once(repository, tree):
+    # Every representation is below both its diagram and its model
+    counts = cascade_delete(repository, Collection.PROJECT, [str(x) for x in tree['projects']], batch_size=2)
+    assert counts == {Collection.PROJECT: 4, Collection.DIAGRAM: 8, Collection.MODEL: 12,
+                      Collection.MODEL_REPRESENTATION: 24}
+    assert _counts(repository)[Collection.MODEL_REPRESENTATION] == 0
+
+
+def test_references_are_pulled(repository, tree):
+    cascade_delete(repository, Collection.USER, [tree['user']])
+    for collection in (Collection.WORKSPACE, Collection.TEAM, Collection.PROJECT):
+        assert all(x['users'] == [] for x in repository.iterate(collection))
+
+    team = next(repository.iterate(Collection.TEAM))
+    cascade_delete(repository, Collection.TEAM, [team['_id']])
+    assert all(x['teams'] == [] for x in repository.iterate(Collection.PROJECT, {'workspaceId': team['workspaceId']}))
+
+    model_id = tree['models'][0]
+    cascade_delete(repository, Collection.MODEL, [model_id])
+    assert all(x['target'] != model_id for m in repository.iterate(Collection.MODEL) for x in m['relations'])
+    diagram = repository.find_one(Collection.DIAGRAM, _id=tree['diagrams'][0])
+    assert len(diagram['models']) == 2
+    assert repository.find_one(Collection.MODEL_REPRESENTATION, modelId=model_id) is None
+
+
+def test_rollback_with_transaction(repository, tree, monkeypatch):
+    before = _counts(repository)
+    delete_many = repository.delete_many
+    calls = []
+
+    def failing_delete_many(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 3:
+            raise RuntimeError('connection lost')
+        return delete_many(*args, **kwargs)
+
+    monkeypatch.setattr(repository, 'delete_many', failing_delete_many)
+    with pytest.raises(RuntimeError):
+        cascade_delete(repository, Collection.WORKSPACE, tree['workspaces'], use_transaction=True)
+    monkeypatch.undo()
+    assert _counts(repository) == before
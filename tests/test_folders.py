@@ -0,0 +1,105 @@
+import pytest
+from bson.objectid import ObjectId
+
+from bpr_data.folders import list_folder, move_folder, normalize_path, rename_folder
+from bpr_data.repository import Collection, Repository
+
+
+@pytest.fixture
+def repository():
+    Repository.reset_instance()
+    repository = Repository.get_in_memory_instance()
+    yield repository
+    Repository.reset_instance()
+
+
+@pytest.fixture
+def project_id(repository):
+    project_id = ObjectId()
+    repository.insert_many(Collection.PROJECT, [{
+        '_id': project_id, 'title': 'Project', 'workspaceId': ObjectId(), 'users': [], 'teams': [],
+        'folders': ['/a', '/a/b', '/a/b/c', '/ab', '/d']
+    }])
+    repository.insert_many(Collection.MODEL, [
+        {'_id': ObjectId(), 'projectId': project_id, 'path': path, 'type': 'class',
+         'history': [], 'relations': [], 'attributes': []}
+        for path in ('/', '/a', '/a/b', '/a/b/c', '/ab', '/d')
+    ])
+    repository.insert_many(Collection.DIAGRAM, [
+        {'_id': ObjectId(), 'projectId': project_id, 'path': path, 'title': path, 'models': []}
+        for path in ('/a', '/ab')
+    ])
+    # Documents of another project must never be touched
+    repository.insert_many(Collection.MODEL, [
+        {'_id': ObjectId(), 'projectId': ObjectId(), 'path': '/a', 'type': 'class',
+         'history': [], 'relations': [], 'attributes': []}
+    ])
+    return project_id
+
+
+def _paths(repository: Repository, collection: Collection, project_id: ObjectId) -> list:
+    return sorted(x['path'] for x in repository.iterate(collection, {'projectId': project_id}))
+
+
+def _folders(repository: Repository, project_id: ObjectId) -> list:
+    return repository.find_one(Collection.PROJECT, _id=project_id)['folders']
+
+
+def test_normalize_path():
+    assert normalize_path('') == '/'
+    assert normalize_path('a//b/') == '/a/b'
+
+
+def test_list_folder(repository, project_id):
+    listing = list_folder(repository, project_id, '/a')
+    assert [x.path for x in listing.models] == ['/a']
+    assert [x.path for x in listing.diagrams] == ['/a']
+    assert listing.folders == ['/a/b']
+
+
+def test_list_folder_recursive(repository, project_id):
+    listing = list_folder(repository, project_id, 'a', recursive=True)
+    assert sorted(x.path for x in listing.models) == ['/a', '/a/b', '/a/b/c']
+    assert [x.path for x in listing.diagrams] == ['/a']
+
+
+def test_list_root_folder(repository, project_id):
+    listing = list_folder(repository, project_id)
+    assert [x.path for x in listing.models] == ['/']
+    assert listing.folders == ['/a', '/ab', '/d']
+    assert len(list_folder(repository, project_id, recursive=True).models) == 6
+
+
+def test_move_folder(repository, project_id):
+    counts = move_folder(repository, project_id, '/a', '/d/a')
+    assert counts == {Collection.MODEL: 3, Collection.DIAGRAM: 1}
+    assert _paths(repository, Collection.MODEL, project_id) == ['/', '/ab', '/d', '/d/a', '/d/a/b', '/d/a/b/c']
+    assert _paths(repository, Collection.DIAGRAM, project_id) == ['/ab', '/d/a']
+    assert _folders(repository, project_id) == ['/d/a', '/d/a/b', '/d/a/b/c', '/ab', '/d']
+    assert len(list(repository.iterate(Collection.MODEL, {'path': '/a'}))) == 1
+
+
+def test_move_folder_creates_missing_parents(repository, project_id):
+    move_folder(repository, project_id, '/ab', '/x/y')
+    assert _paths(repository, Collection.DIAGRAM, project_id) == ['/a', '/x/y']
+    assert sorted(_folders(repository, project_id)) == ['/a', '/a/b', '/a/b/c', '/d', '/x', '/x/y']
+
+
+def test_rename_folder(repository, project_id):
+    counts = rename_folder(repository, project_id, '/a/b', 'e')
+    assert counts == {Collection.MODEL: 2, Collection.DIAGRAM: 0}
+    assert _paths(repository, Collection.MODEL, project_id) == ['/', '/a', '/a/e', '/a/e/c', '/ab', '/d']
+    assert _folders(repository, project_id) == ['/a', '/a/e', '/a/e/c', '/ab', '/d']
+    with pytest.raises(ValueError):
+        rename_folder(repository, project_id, '/a', 'x/y')
+
+
+def test_invalid_moves(repository, project_id):
+    with pytest.raises(ValueError):
+        move_folder(repository, project_id, '/', '/x')
+    with pytest.raises(ValueError):
+        move_folder(repository, project_id, '/a', '/')
+    with pytest.raises(ValueError):
+        move_folder(repository, project_id, '/a', '/a/b/x')
+    assert move_folder(repository, project_id, '/a', 'a/') == {Collection.MODEL: 0, Collection.DIAGRAM: 0}
+    assert _paths(repository, Collection.MODEL, project_id) == ['/', '/a', '/a/b', '/a/b/c', '/ab', '/d']
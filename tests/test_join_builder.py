@@ -0,0 +1,53 @@
+from bson.objectid import ObjectId
+
+from bpr_data.join_builder import JoinBuilder, find_invitations
+from bpr_data.repository import Collection, Repository
+
+
+def _repository() -> Repository:
+    Repository.reset_instance()
+    return Repository.get_in_memory_instance()
+
+
+def test_lookup_joins_lists_of_ids():
+    repository = _repository()
+    users = [{'_id': ObjectId(), 'name': f'user {i}', 'email': f'{i}@b.com', 'firebaseId': str(i)} for i in range(3)]
+    repository.insert_many(Collection.USER, users)
+    project_id = ObjectId()
+    repository.insert_many(Collection.PROJECT, [
+        {'_id': project_id, 'users': [{'userId': users[0]['_id']}, {'userId': users[2]['_id']}]}
+    ])
+    builder = JoinBuilder(Collection.PROJECT) \
+        .match(id=str(project_id)) \
+        .lookup(Collection.USER, 'users.userId', '_id', 'userObjects', ['name'])
+    lookup = builder.pipeline()[1]['$lookup']
+    assert lookup['localField'] == 'users.userId' and lookup['foreignField'] == '_id'
+    result = builder.execute(repository)
+    assert result[0]['userObjects'] == [{'_id': users[0]['_id'], 'name': 'user 0'},
+                                        {'_id': users[2]['_id'], 'name': 'user 2'}]
+
+
+def test_find_invitations():
+    repository = _repository()
+    inviter, workspace = ObjectId(), ObjectId()
+    repository.insert_many(Collection.USER, [{'_id': inviter, 'name': 'Ann', 'email': 'ann@b.com'}])
+    repository.insert_many(Collection.WORKSPACE, [{'_id': workspace, 'name': 'Space', 'users': []}])
+    repository.insert_many(Collection.INVITATION, [
+        {'_id': ObjectId(), 'workspaceId': workspace, 'inviterId': inviter, 'inviteeEmailAddress': 'bo@b.com'},
+        {'_id': ObjectId(), 'workspaceId': workspace, 'inviterId': ObjectId(), 'inviteeEmailAddress': 'bo@b.com'},
+    ])
+    invitations = find_invitations(repository, inviteeEmailAddress='bo@b.com')
+    assert [(x.inviterUserName, x.workspaceName) for x in invitations] == [('Ann', 'Space'), (None, 'Space')]
+
+
+def test_lookup_fields_sets_null_without_match():
+    repository = _repository()
+    repository.insert_many(Collection.INVITATION, [{'_id': ObjectId(), 'inviterId': ObjectId()}])
+    builder = JoinBuilder(Collection.INVITATION).lookup_fields(Collection.USER, 'inviterId', '_id', inviterName='name')
+    # MongoDB leaves the field out when $arrayElemAt has no element, the null must come from $ifNull
+    assert builder.pipeline()[1]['$addFields'] == {
+        'inviterName': {'$ifNull': [{'$arrayElemAt': ['$_joined0.name', 0]}, None]}
+    }
+    result = builder.execute(repository)
+    assert 'inviterName' in result[0] and result[0]['inviterName'] is None
+    assert '_joined0' not in result[0]
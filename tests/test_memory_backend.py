@@ -0,0 +1,179 @@
+import pytest
+from bson.objectid import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from bpr_data.memory_backend import MemoryClient
+
+
+@pytest.fixture
+def database():
+    return MemoryClient().get_default_database()
+
+
+@pytest.fixture
+def models(database):
+    collection = database['model']
+    collection.insert_many([
+        {'_id': 1, 'name': 'A', 'path': '/a', 'tags': ['x'], 'attributes': [
+            {'_id': 10, 'name': 'id', 'type': 'int'},
+            {'_id': 11, 'name': 'title', 'type': 'str'},
+        ]},
+        {'_id': 2, 'name': 'B', 'path': '/b', 'tags': [], 'attributes': [
+            {'_id': 20, 'name': 'id', 'type': 'str'},
+        ]},
+    ])
+    return collection
+
+
+# QUERIES
+
+def test_match_equality_and_comparison(models):
+    assert [x['_id'] for x in models.find({'name': 'A'})] == [1]
+    assert [x['_id'] for x in models.find({'_id': {'$gte': 2}})] == [2]
+    assert [x['_id'] for x in models.find({'attributes.name': 'title'})] == [1]
+    assert [x['_id'] for x in models.find({'missing': None})] == [1, 2]
+
+
+def test_match_elem_match(models):
+    query = {'attributes': {'$elemMatch': {'name': 'id', 'type': 'str'}}}
+    assert [x['_id'] for x in models.find(query)] == [2]
+
+
+def test_match_boolean_does_not_equal_number(database):
+    collection = database['flags']
+    collection.insert_many([{'_id': 1, 'v': True}, {'_id': 2, 'v': 1}, {'_id': 3, 'v': [0, False]}])
+    for indexed in (False, True):
+        if indexed:
+            collection.create_index('v')
+        assert [x['_id'] for x in collection.find({'v': 1})] == [2]
+        assert [x['_id'] for x in collection.find({'v': True})] == [1]
+        assert [x['_id'] for x in collection.find({'v': {'$in': [False]}})] == [3]
+        assert [x['_id'] for x in collection.find({'v': 0})] == [3]
+
+
+# UPDATES
+
+def test_set_nested_field(models):
+    models.update_one({'_id': 1}, {'$set': {'meta.version': 2}})
+    assert models.find_one({'_id': 1})['meta'] == {'version': 2}
+
+
+def test_add_to_set_each(models):
+    models.update_one({'_id': 1}, {'$addToSet': {'tags': {'$each': ['x', 'y', 'y']}}})
+    assert models.find_one({'_id': 1})['tags'] == ['x', 'y']
+
+
+def test_add_to_set_keeps_boolean_next_to_number(database):
+    database['flags'].insert_one({'_id': 1, 'values': [1]})
+    database['flags'].update_one({'_id': 1}, {'$addToSet': {'values': True}})
+    assert database['flags'].find_one({'_id': 1})['values'] == [1, True]
+
+
+def test_pull_by_condition(models):
+    models.update_one({'_id': 1}, {'$pull': {'attributes': {'name': 'title'}}})
+    assert [x['_id'] for x in models.find_one({'_id': 1})['attributes']] == [10]
+
+
+def test_positional_operator(models):
+    models.update_one({'_id': 1, 'attributes._id': 11}, {'$set': {'attributes.$.type': 'text'}})
+    attributes = models.find_one({'_id': 1})['attributes']
+    assert [x['type'] for x in attributes] == ['int', 'text']
+
+
+def test_update_changing_only_the_type_is_written(database):
+    collection = database['flags']
+    collection.insert_many([{'_id': 1, 'v': True}, {'_id': 2, 'v': 1}])
+    assert collection.update_one({'_id': 1}, {'$set': {'v': 1}}).modified_count == 1
+    assert collection.update_one({'_id': 2}, {'$set': {'v': 1.0}}).modified_count == 1
+    assert collection.update_one({'_id': 2}, {'$set': {'v': 1.0}}).modified_count == 0
+    assert [type(x['v']) for x in collection.find()] == [int, float]
+    assert [x['_id'] for x in collection.find({'v': True})] == []
+
+
+# AGGREGATION
+
+def test_lookup_local_and_foreign_field(database, models):
+    database['representation'].insert_many([{'_id': 100, 'modelId': 1}, {'_id': 101, 'modelId': 3}])
+    result = list(database['representation'].aggregate([
+        {'$lookup': {'from': 'model', 'localField': 'modelId', 'foreignField': '_id', 'as': 'model'}},
+    ]))
+    assert [[m['name'] for m in x['model']] for x in result] == [['A'], []]
+
+
+def test_lookup_local_field_with_pipeline(database, models):
+    database['representation'].insert_one({'_id': 100, 'modelIds': [1, 2]})
+    result = list(database['representation'].aggregate([
+        {'$lookup': {'from': 'model', 'localField': 'modelIds', 'foreignField': '_id',
+                     'pipeline': [{'$project': {'name': 1}}], 'as': 'models'}},
+    ]))
+    assert result[0]['models'] == [{'_id': 1, 'name': 'A'}, {'_id': 2, 'name': 'B'}]
+
+
+def test_unwind_outputs_are_independent(database):
+    database['items'].insert_one({'_id': 1, 'meta': {'k': 0}, 'xs': [1, 2, 3]})
+    result = list(database['items'].aggregate([{'$unwind': '$xs'}, {'$addFields': {'meta.k': '$xs'}}]))
+    assert [x['meta']['k'] for x in result] == [1, 2, 3]
+
+
+def test_unwind_preserve_null_and_empty_arrays(models):
+    result = list(models.aggregate([
+        {'$unwind': {'path': '$tags', 'preserveNullAndEmptyArrays': True, 'includeArrayIndex': 'i'}},
+    ]))
+    assert [(x['_id'], x.get('tags'), x['i']) for x in result] == [(1, 'x', 0), (2, None, None)]
+
+
+def test_arithmetic_with_null_returns_null(database):
+    database['items'].insert_one({'_id': 1, 'x': 5, 'w': None})
+    result = list(database['items'].aggregate([{'$project': {
+        'add': {'$add': ['$x', '$w']},
+        'missing': {'$add': ['$x', '$nope']},
+        'subtract': {'$subtract': ['$x', '$w']},
+        'sum': {'$add': ['$x', 1]},
+    }}]))
+    assert result[0] == {'_id': 1, 'add': None, 'missing': None, 'subtract': None, 'sum': 6}
+
+
+def test_missing_values_leave_fields_out(database):
+    database['items'].insert_one({'_id': 1, 'xs': [], 'meta': {}})
+    added = list(database['items'].aggregate([
+        {'$addFields': {'first': {'$arrayElemAt': ['$xs', 0]}, 'copy': '$missing', 'nested': '$meta.missing'}},
+    ]))
+    assert added == [{'_id': 1, 'xs': [], 'meta': {}}]
+    projected = list(database['items'].aggregate([
+        {'$project': {'xs': 1, 'computed': '$missing', 'object': {'a': '$missing', 'b': 1}}},
+    ]))
+    assert projected == [{'_id': 1, 'xs': [], 'object': {'b': 1}}]
+
+
+def test_if_null_replaces_missing_values(database):
+    database['items'].insert_one({'_id': 1, 'xs': []})
+    result = list(database['items'].aggregate([
+        {'$addFields': {'first': {'$ifNull': [{'$arrayElemAt': ['$xs', 0]}, None]}, 'list': ['$missing']}},
+    ]))
+    assert result == [{'_id': 1, 'xs': [], 'first': None, 'list': [None]}]
+
+
+# INDEXES
+
+def test_index_follows_updates(models):
+    models.create_index('attributes.name')
+    models.update_one({'_id': 2}, {'$set': {'attributes.0.name': 'key'}})
+    assert [x['_id'] for x in models.find({'attributes.name': 'id'})] == [1]
+    assert [x['_id'] for x in models.find({'attributes.name': 'key'})] == [2]
+
+
+def test_index_follows_deletes(models):
+    models.create_index('path')
+    models.delete_one({'_id': 1})
+    assert models.count_documents({'path': '/a'}) == 0
+    models.insert_one({'_id': 3, 'path': '/a'})
+    assert [x['_id'] for x in models.find({'path': '/a'})] == [3]
+
+
+def test_unique_index(database):
+    collection = database['user']
+    collection.create_index('email', unique=True)
+    collection.insert_one({'_id': ObjectId(), 'email': 'a@b.com'})
+    with pytest.raises(DuplicateKeyError):
+        collection.insert_one({'_id': ObjectId(), 'email': 'a@b.com'})
+
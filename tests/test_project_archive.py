@@ -0,0 +1,78 @@
+import io
+
+import bson
+import pytest
+from bson.objectid import ObjectId
+
+from bpr_data.project_archive import duplicate_project, export_project, import_project
+from bpr_data.repository import Collection, Repository
+
+
+@pytest.fixture
+def repository():
+    Repository.reset_instance()
+    repository = Repository.get_in_memory_instance()
+    yield repository
+    Repository.reset_instance()
+
+
+@pytest.fixture
+def project_id(repository):
+    project_id, diagram_id, a, b = ObjectId(), ObjectId(), ObjectId(), ObjectId()
+    repository.insert_many(Collection.PROJECT, [{'_id': project_id, 'title': 'Original', 'workspaceId': ObjectId()}])
+    repository.insert_many(Collection.MODEL, [
+        {'_id': a, 'projectId': project_id, 'name': 'A', 'relations': [{'_id': ObjectId(), 'target': b}]},
+        {'_id': b, 'projectId': project_id, 'name': 'B', 'relations': []},
+    ])
+    repository.insert_many(Collection.DIAGRAM, [{'_id': diagram_id, 'projectId': project_id, 'models': []}])
+    repository.insert_many(Collection.MODEL_REPRESENTATION, [
+        {'_id': ObjectId(), 'diagramId': diagram_id, 'modelId': a, 'x': 0, 'y': 0, 'w': 10, 'h': 10}
+    ])
+    return project_id
+
+
+def _counts(repository: Repository) -> dict:
+    return {x: len(list(repository.iterate(x))) for x in
+            (Collection.PROJECT, Collection.MODEL, Collection.DIAGRAM, Collection.MODEL_REPRESENTATION)}
+
+
+@pytest.mark.parametrize('use_transaction', [False, True])
+def test_duplicate_project_remaps_references(repository, project_id, use_transaction):
+    copy_id = duplicate_project(repository, project_id, title='Copy', use_transaction=use_transaction)
+    assert repository.find_one(Collection.PROJECT, _id=copy_id)['title'] == 'Copy'
+    models = {x['name']: x for x in repository.iterate(Collection.MODEL, {'projectId': copy_id})}
+    assert models['A']['relations'][0]['target'] == models['B']['_id']
+    representation = next(repository.iterate(Collection.MODEL_REPRESENTATION, {'modelId': models['A']['_id']}))
+    assert repository.find_one(Collection.DIAGRAM, _id=representation['diagramId'])['projectId'] == copy_id
+
+
+def test_export_import_round_trip(repository, project_id):
+    archive = io.BytesIO()
+    counts = export_project(repository, project_id, archive)
+    assert counts[Collection.MODEL] == 2
+    archive.seek(0)
+    import_id = import_project(repository, archive, title='Imported')
+    assert import_id != project_id
+    assert _counts(repository) == {Collection.PROJECT: 2, Collection.MODEL: 4, Collection.DIAGRAM: 2,
+                                   Collection.MODEL_REPRESENTATION: 2}
+
+
+def _corrupt_archive(repository: Repository, project_id: ObjectId) -> io.BytesIO:
+    archive = io.BytesIO()
+    export_project(repository, project_id, archive, compress=False)
+    data = archive.getvalue()
+    return io.BytesIO(data + bson.encode({'c': 'not a collection', 'd': {}}))
+
+
+def test_failed_import_writes_no_project(repository, project_id):
+    before = _counts(repository)
+    with pytest.raises(ValueError):
+        import_project(repository, _corrupt_archive(repository, project_id))
+    assert _counts(repository)[Collection.PROJECT] == before[Collection.PROJECT]
+
+
+def test_failed_import_in_transaction_writes_nothing(repository, project_id):
+    before = _counts(repository)
+    with pytest.raises(ValueError):
+        import_project(repository, _corrupt_archive(repository, project_id), use_transaction=True)
+    assert _counts(repository) == before
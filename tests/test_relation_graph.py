@@ -0,0 +1,33 @@
+from bson.objectid import ObjectId
+
+from bpr_data.relation_graph import RelationGraph
+
+
+def test_apply_normalises_string_ids():
+    source, target, relation_id = ObjectId(), ObjectId(), ObjectId()
+    graph = RelationGraph(ObjectId())
+    graph.apply(source, {'action': 'createRelation',
+                         'item': {'_id': str(relation_id), 'target': str(target), 'type': 'association'}})
+    assert graph.targets(source) == [target]
+    assert graph.sources(target) == [source]
+
+    new_target = ObjectId()
+    graph.apply(source, {'action': 'updateRelation',
+                         'oldItem': {'_id': str(relation_id), 'target': str(target)},
+                         'newItem': {'_id': str(relation_id), 'target': str(new_target), 'type': 'association'}})
+    assert graph.targets(source) == [new_target]
+    assert graph.sources(target) == []
+
+    graph.apply(source, {'action': 'removeRelation', 'itemId': str(relation_id)})
+    assert graph.targets(source) == []
+    assert graph.sources(new_target) == []
+
+
+def test_traverse_follows_relations_both_ways():
+    a, b, c = ObjectId(), ObjectId(), ObjectId()
+    graph = RelationGraph(ObjectId())
+    graph.add_relation(a, {'_id': ObjectId(), 'target': b, 'type': 'inheritance'})
+    graph.add_relation(b, {'_id': ObjectId(), 'target': c, 'type': 'association'})
+    assert graph.traverse(a) == {b: 1, c: 2}
+    assert graph.traverse(c, reverse=True, max_depth=1) == {b: 1}
+    assert graph.traverse(a, relation_types=['inheritance']) == {b: 1}
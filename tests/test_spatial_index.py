@@ -0,0 +1,69 @@
+import random
+
+from bson.objectid import ObjectId
+
+from bpr_data.repository import Collection, Repository
+from bpr_data.spatial_index import SpatialIndex, find_in_viewport
+
+
+def test_query_and_hit_test():
+    index = SpatialIndex(cell_size=10)
+    index.insert('a', 0, 0, 5, 5)
+    index.insert('b', 20, 20, -5, -5)
+    assert index.query(4, 4, 12, 12) == ['a', 'b']
+    assert index.query(16, 16, -1, -1) == ['b']
+    assert index.hit_test(17, 17) == ['b']
+    index.remove('a')
+    assert index.query(0, 0, 5, 5) == []
+
+
+def test_large_boxes_do_not_fill_the_grid():
+    index = SpatialIndex(cell_size=10)
+    index.insert('huge', 0, 0, 1e6, 1e6)
+    index.bulk_load([{'_id': 'also huge', 'x': -1e6, 'y': -1e6, 'w': 2e6, 'h': 2e6},
+                     {'_id': 'small', 'x': 5, 'y': 5, 'w': 1, 'h': 1}])
+    assert index._large == {'huge', 'also huge'}
+    assert len(index._cells) == 1
+    assert index.query(-1e9, -1e9, 2e9, 2e9) == ['huge', 'also huge', 'small']
+    assert index.hit_test(500, 500) == ['huge', 'also huge']
+    assert index.query(4, 4, 2, 2) == ['huge', 'also huge', 'small']
+    index.remove('huge')
+    assert index.hit_test(500, 500) == ['also huge']
+
+
+def test_bulk_load_keeps_last_box_of_repeated_id():
+    index = SpatialIndex(cell_size=10)
+    index.bulk_load([{'_id': 1, 'x': 0, 'y': 0, 'w': 5, 'h': 5},
+                     {'_id': 2, 'x': 100, 'y': 100, 'w': 5, 'h': 5},
+                     {'_id': 1, 'x': 500, 'y': 500, 'w': 5, 'h': 5}])
+    assert index.query(0, 0, 6, 6) == []
+    assert index.query(0, 0, 600, 600) == [2, 1]
+    index.remove(1)
+    assert index.query(0, 0, 6, 6) == []
+    assert index.query(0, 0, 600, 600) == [2]
+
+
+def test_grid_matches_vectorized_queries():
+    rng = random.Random(0)
+    index = SpatialIndex(cell_size=50)
+    index.bulk_load([{'_id': i, 'x': rng.uniform(0, 1000), 'y': rng.uniform(0, 1000),
+                      'w': rng.uniform(-300, 300), 'h': rng.uniform(-300, 300)} for i in range(200)])
+    viewports = [(rng.uniform(0, 1000), rng.uniform(0, 1000), rng.uniform(-200, 200), rng.uniform(-200, 200))
+                 for _ in range(50)]
+    assert index.query_many(viewports) == [index.query(*x) for x in viewports]
+
+
+def test_find_in_viewport_agrees_with_index():
+    Repository.reset_instance()
+    repository = Repository.get_in_memory_instance()
+    diagram_id = ObjectId()
+    rng = random.Random(1)
+    representations = [{'_id': ObjectId(), 'diagramId': diagram_id, 'x': rng.uniform(0, 100), 'y': rng.uniform(0, 100),
+                        'w': rng.uniform(-20, 20), 'h': rng.uniform(-20, 20)} for _ in range(100)]
+    representations.append({'_id': ObjectId(), 'diagramId': diagram_id, 'x': 10, 'y': 10, 'w': -5, 'h': 1})
+    repository.insert_many(Collection.MODEL_REPRESENTATION, representations)
+    index = SpatialIndex.build(repository, diagram_id, cell_size=10)
+    for viewport in [(6, 11, 1, 1), (7, 12, -1, -1), (50, 50, -30, 20), (0, 0, 100, 100)]:
+        found = [x['_id'] for x in find_in_viewport(repository, diagram_id, *viewport)]
+        assert found == index.query(*viewport)
+    Repository.reset_instance()